@@ -2,15 +2,23 @@ import os
 import time
 import numpy as np
 from src.Maps import Maps, Map
-from shutil import copy
+from src.MapData import MapData
 from src.PlotFrame import PlotFrame
 from src.LegFrame import LegFrame
 from src.StatFrame import StatFrame
 from src.TabNotebook import TabNotebook
 from src.Averages import Averages
-from tkinter.filedialog import askopenfilename
-from tkinter.messagebox import askyesno, showinfo
-from settings import TEMP_PATH, LOGS, IMAGES, ABOUT_TITLE, ABOUT_TEXT
+from src.JobRunner import JobRunner, Job
+from src.Recipe import Recipe, findMaps
+from src.MapIndex import MapIndex
+from src.PixelInspector import PixelInspector, pixelTotals
+from src.SpectraWriter import SpectraWriter
+from src.Global_Functions import coordinateName
+from functools import partial
+from multiprocessing import freeze_support
+from tkinter.filedialog import askopenfilename, asksaveasfilename, askdirectory
+from tkinter.messagebox import askyesno, showinfo, showerror
+from settings import TEMP_PATH, LOGS, IMAGES, COLORS, ABOUT_TITLE, ABOUT_TEXT
 from tkinter import Tk, BooleanVar, StringVar, Menu, Toplevel, Label, Entry, Button
 
 class GUI(Tk):
@@ -24,16 +32,28 @@ class GUI(Tk):
         self.resizable(False, False)
         self.iconbitmap(rf'{IMAGES}/main.ico')
         
+        ### Folder for the working copies of the maps
+        os.makedirs(TEMP_PATH, exist_ok = True)
+        
         ### Create program Maps and Averages instances to keep track
         self.maps = Maps()
         self.averages = Averages()
         
+        ### Runs the long operations in the background
+        self.jobs = JobRunner(self)
+        
+        ### Processing steps applied to the maps, to replay them on other maps
+        self.recipe = Recipe()
+        
+        ### Statistics shown with the average spectra
+        self.varShowStd = BooleanVar(value = False)
+        self.varShowMedian = BooleanVar(value = False)
+        
         ### Configure the GUI
         self.configMenu()
         self.configFrames()
         
         ### Define variables for program state checking
-        self.firstOpen = BooleanVar(value = True)
         self.varSelectedMap = StringVar(value = '')
         self.reversingTabChange = False
         
@@ -43,19 +63,31 @@ class GUI(Tk):
         response = askyesno('Exit', 
                             'Are you sure you want to exit?')
         if response:
-            self.resetGUI()
-            try:
-                self.destroy()
-            except:
-                self.quit()
+            # Stop any process running in the background, and only close once it stopped using the temp files
+            self.jobs.cancel(then = self.closeWindow)
+        return 0
+    
+    def closeWindow(self):
+        ''' Resets GUI variables and closes the program '''
+        self.resetGUI()
+        try:
+            self.destroy()
+        except:
+            self.quit()
         return 0
     
     def resetGUI(self):
         ''' Clears all program variables '''
+        # The running job still uses the maps and the temp files
+        if self.jobs.isBusy():
+            showerror('Error',
+                      'Another process is running')
+            return 1
+        
         self.maps.clear()
         self.averages.clear()
-        self.firstOpen.set(True)
         self.varSelectedMap.set('')
+        self.recipe.clear()
         self.cleanAll()
     
         # Remove all files from temp folder
@@ -67,6 +99,12 @@ class GUI(Tk):
         ''' Opens dialog to choose the map files to be processed.
             If the file name is more than 80 characters long, 
             is requests aliases to stay away from maximum path length'''
+        # The running job still uses the current maps
+        if self.jobs.isBusy():
+            showerror('Error',
+                      'Another process is running')
+            return 1
+        
         if not self.maps.isEmpty():
             # Only allow to open one batch of maps at a time
             response = askyesno('Confirm',
@@ -108,6 +146,10 @@ class GUI(Tk):
         else:
             self.insertLog('open')
     
+        # Writes all the map data in temp folder
+        for map in self.maps:
+           self.writeMap(map)
+        
         # Update legend to display open files
         self.legFrame.updateLegend()
         
@@ -118,12 +160,6 @@ class GUI(Tk):
         
         # Calls the active tab's displaySpectra method
         self.onTabChange()
-        
-        # Writes all the map data in temp folder
-        for map in self.maps:
-           self.writeMap(map)
-        
-        self.firstOpen.set(False)
         return 0
     
     def requireAliases(self, filenames):
@@ -215,6 +251,18 @@ class GUI(Tk):
                 file.write('Wavenumber(cm-1)\tIntensity\n')
                 for freq, inten in zip(frequencies, intensities):
                     file.write(f'{freq:.2f}\t{inten:.2f}\n')
+            
+            # Writes the spectra statistics at each frequency
+            statistics = spectra[2]
+            columns = [frequencies, statistics['mean'], statistics['std'], statistics['min'], statistics['max']]
+            header = 'Wavenumber(cm-1)\tMean\tStd\tMin\tMax'
+            
+            for percentile, values in statistics['percentiles'].items():
+                columns.append(values)
+                header += f'\tP{percentile}'
+            
+            np.savetxt(f'{map.name}_statistics.txt', np.column_stack(columns), 
+                       fmt = '%.2f', delimiter = '\t', header = header, comments = '')
         
         # Log process
         self.insertLog('average_save')
@@ -223,63 +271,139 @@ class GUI(Tk):
         os.chdir(TEMP_PATH)
         return 0
     
-    def saveIndSpectra(self):
-        ''' Saves hte spectra for each point in the current maps '''
+    def saveIndSpectra(self, archive: bool = False):
+        ''' Saves the spectra for each point in the current maps.
+            With archive, the spectra files of each map are stored in a single zip file '''
         if self.maps.isEmpty():
             return 1
         
         # For potentially long processes, the progress bar in the Status Frame is used to avoid user panic
-        progressStep = 300 / (self.maps.length() * self.maps[0].spectraNum)
-        self.statFrame.progressLabel.config(text = 'Processing:   Saving individual spectra')
+        total = self.maps.length() * self.maps[0].spectraNum
         
+        # The spectra are saved in the background
+        self.jobs.run('Saving individual spectra', 
+                      partial(self.writeIndSpectra, archive), 
+                      self.finishIndSpectra, 
+                      total)
+        return 0
+    
+    def writeIndSpectra(self, archive: bool, job: Job):
+        ''' Writes the spectra files of each map. Runs in the background, so it does not use any widget '''
         for map in self.maps:
             
-            # Gets map data as a dict
+            # Gets map data, read one block at a time
             mapData = self.readMap(map)
             
-            os.chdir(map.directory)
+            os.makedirs(f'{map.directory}/{map.orig}_Files', exist_ok = True)
             
-            os.makedirs(f'{map.orig}_Files/Individual Spectra', exist_ok = True)
-            
-            os.chdir(f'{map.orig}_Files/Individual Spectra')
-            
-            frequencies = mapData.pop('freq')
-            
-            # For each key, write a new file
-            for key, intensities in mapData.values():
-                # Remove decimal to avoid filename corruption
-                x = key[0].replace('.', '')
-                y = key[1].replace('.', '')
-
-                # Save the number of decimals for the filename
-                if '.' in key[0]:
-                    xDec = len(key[0]) - key[0].index('.') - 1
-                else:
-                    xDec = 0
-                
-                if '.' in key[1]:
-                    yDec = len(key[1]) - key[1].index('.') - 1
-                else:
-                    yDec = 0
-                
-                with open(f'{map.name}_X_{x}_E-{xDec}_Y_{y}_E-{yDec}.txt', 'w') as file:
-                    file.write('Wavenumber(cm-1)\tIntensity\n')   
+            # Write a file for each key, a block of spectra at a time
+            with SpectraWriter(f'{map.directory}/{map.orig}_Files/Individual Spectra', 
+                               mapData.freq, archive = archive) as writer:
+                for block in mapData.blocks():
+                    writer.write([f'{map.name}_{coordinateName(key)}.txt' for key in mapData.coords[block]], 
+                                 mapData.spectra[block])
                     
-                    for freq, inten in zip(frequencies, intensities):
-                        file.write(f'{freq:.2f}\t{inten:.2f}\n')
-                
-                # Update progress bar
-                self.statFrame.progressBar['value'] += progressStep
-                self.statFrame.update_idletasks()
-        
-        # Reset progress bar
-        self.statFrame.progressBar['value'] = 0
-        self.statFrame.progressLabel.config(text = 'Processing: ')
-        
+                    # Update progress bar
+                    job.progress(block.stop - block.start)
+        return 0
+    
+    def finishIndSpectra(self, result: int):
+        ''' Informs the user once the individual spectra are saved '''
         # Log process
         self.insertLog('individual_save')
         showinfo('Save', 'Individual spectra saved')
-        os.chdir(TEMP_PATH)
+        return 0
+    
+    def saveRecipe(self):
+        ''' Saves the processing steps applied to the current maps as a recipe file '''
+        if self.recipe.isEmpty():
+            showinfo('Information', 
+                     'No processing steps were saved yet')
+            return 1
+        
+        filename = asksaveasfilename(title = 'Save recipe', 
+                                     defaultextension = '.json', 
+                                     filetypes = (('Recipe files', '*.json'),))
+        if not filename:
+            return 1
+        
+        self.recipe.save(filename)
+        
+        # Log process
+        self.insertLog('recipe_save')
+        return 0
+    
+    def applyRecipe(self):
+        ''' Replays a recipe file over every map in a folder, without opening them '''
+        filename = askopenfilename(title = 'Open recipe', 
+                                   filetypes = (('Recipe files', '*.json'),))
+        if not filename:
+            return 1
+        
+        try:
+            recipe = Recipe.load(filename)
+        except ValueError as error:
+            showerror('Error', str(error))
+            return 1
+        
+        folder = askdirectory(title = 'Folder with the maps')
+        if not folder:
+            return 1
+        
+        filenames = findMaps(folder, recipe)
+        if not filenames:
+            showerror('Error', 
+                      'No map files in the folder')
+            return 1
+        
+        # The maps are processed in the background
+        self.jobs.run('Applying recipe', 
+                      partial(self.replayRecipe, recipe, filenames), 
+                      self.finishRecipe)
+        return 0
+    
+    def replayRecipe(self, recipe: Recipe, filenames: list, job: Job):
+        ''' Applies the recipe to each map file. Runs in the background, so it does not use any widget '''
+        # The number of spectra is only known after reading each map header
+        job.setTotal(sum(recipe.workload(MapData.readHeader(filename)[1]) for filename in filenames))
+        
+        for filename in filenames:
+            recipe.apply(filename, os.cpu_count() or 1, job.progress)
+        return len(filenames)
+    
+    def finishRecipe(self, result: int):
+        ''' Informs the user once the recipe is applied '''
+        # Log process
+        self.insertLog('recipe')
+        showinfo('Information', f'Recipe applied to {result} maps')
+        return 0
+    
+    def inspectPixels(self):
+        ''' Opens the pixel inspector for the map selected in the legend, or the first map.
+            The index of its map file is built in the background the first time, and cached in the temp folder.
+            The pixel intensities of the image are also computed in the background '''
+        if self.maps.isEmpty():
+            return 1
+        
+        selected = [map for map in self.maps if map.orig == self.varSelectedMap.get()]
+        map = selected[0] if selected else self.maps[0]
+        
+        self.jobs.run('Indexing map file', 
+                      partial(self.indexMap, map), 
+                      partial(self.openInspector, map), 
+                      2 * map.spectraNum)
+        return 0
+    
+    def indexMap(self, map: Map, job: Job):
+        ''' Returns the index of the original map file and the total intensity of each spectrum 
+            of the working copy. Runs in the background, so it does not use any widget '''
+        index = MapIndex.cached(f'{map.directory}/{map.orig}.txt', f'{TEMP_PATH}/{map.orig}', job.progress)
+        return index, pixelTotals(self.readMap(map), job.progress)
+    
+    def openInspector(self, map: Map, result: tuple):
+        ''' Shows the pixel inspector once the map file is indexed '''
+        index, totals = result
+        PixelInspector(self, map, index, totals)
         return 0
     
     def onTabChange(self, event = None):
@@ -330,65 +454,75 @@ class GUI(Tk):
         return 0
     
     def readMap(self, map: Map):
-        ''' For a Map class instance, it returns a dictionary for the map data.
-            For the key 'freq', its values are the frequencies.
-            For a key (x, y) the coordintes in the map, its values are the intensities at each frequency. '''
-        mapData = {}    
+        ''' For a Map class instance, it returns a MapData instance for the map data,
+            containing the frequencies, the (x, y) coordinates and the intensities of each spectrum.
+            The spectra are memory-mapped from the binary working copy in the temp folder. '''
+        return MapData.fromBinary(f'{TEMP_PATH}/{map.orig}_{map.revision}')
     
-        # The first time the programs calls this, use the original file, else use the temp files
-        os.chdir(map.directory) if self.firstOpen.get() else os.chdir(TEMP_PATH)
-        
-        with open(f'{map.orig}.txt', 'r') as file:
-            lines = file.readlines()
-        
-        # Get the frequencies
-        mapData['freq'] = [float(freq) for freq in lines[0].split()]
-        
-        lines = lines[1:]
-        for line in lines:
-            lineSplit = line.split()
-            y = lineSplit[0]
-            x = lineSplit[1]
-
-            # Get the x, y point intensities
-            mapData[(x,y)] = [float(intensity) for intensity in lineSplit[2:]]
-    
-        return mapData
+    def createMap(self, map: Map, frequencies: np.ndarray, coords: np.ndarray):
+        ''' Returns an empty memory-mapped MapData for the next revision of the Map instance.
+            It is filled block by block by the processing methods and saved with writeMap '''
+        return MapData.create(f'{TEMP_PATH}/{map.orig}_{map.revision + 1}', frequencies, coords)
     
-    def writeMap(self, map: Map, mapData: dict = None):
-        ''' For a Map class instance, it writes the map data for it in the temp foldes.
-        If mapData(dict) is given, it also writes the new data in the original folder, 
-        with the current Map.name '''
-
-        fnTemp = f'{TEMP_PATH}/{map.orig}.txt'
-        
-        # If mapData is not given, only update temp file
-        temp = False
+    def writeMap(self, map: Map, mapData: MapData = None, name: str = None):
+        ''' For a Map class instance, it writes the map data for it in the temp foldes as a binary working copy.
+        If mapData is not given, the original map file is converted to the first working copy.
+        If mapData is given, it is written as the next revision of the working copy and as a map file 
+        called name in the original folder. The Map instance is not changed, so it can run in the background.
+        The new revision is only used once it is committed with commitMaps '''
+        # If mapData is not given, only create temp file
         if mapData is None:
-            temp = True
-            mapData = self.readMap(map)
+            mapData = MapData.convertFile(f'{map.directory}/{map.orig}.txt', 
+                                          f'{TEMP_PATH}/{map.orig}_{map.revision}')
+            
+            # Used for progress bar checking
+            if map.spectraNum is None:
+                map.spectraNum = len(mapData)
+            
+            mapData.toBinary(f'{TEMP_PATH}/{map.orig}_{map.revision}', 
+                             {'name': map.name, 'orig': map.orig})
+            return 0
         
-        # Used for progress bar checking
-        if map.spectraNum is None:
-            map.spectraNum = len(mapData) - 1
+        mapData.toBinary(f'{TEMP_PATH}/{map.orig}_{map.revision + 1}', 
+                         {'name': name, 'orig': map.orig})
         
-        # Write file exactly as the input file formats
-        with open(fnTemp, 'w') as tempFile:
-            tempFile.write('\t\t')
-            [tempFile.write(f'{freq:.3f}\t') for freq in mapData['freq']]
-            tempFile.write('\n')
-            mapData.pop('freq')
+        # Write the file exactly as the input file formats to the original directory
+        mapData.toFile(f'{map.directory}/{name}.txt')
+        return 0
+    
+    def commitMaps(self, saved: list):
+        ''' Makes the revisions written by writeMap the current working copies. saved has a (Map, name) tuple
+        for each written map. Runs in the main thread once the job writing them ended, so the working copies
+        are never changed or removed while they are displayed '''
+        for map, name in saved:
+            # Remove the previous working copy. It can still be in use in some platforms,
+            # in which case it is removed when the program settings are restored
+            for extension in ['npy', 'json']:
+                try:
+                    os.remove(f'{TEMP_PATH}/{map.orig}_{map.revision}.{extension}')
+                except OSError:
+                    pass
             
-            for key in mapData:
-                
-                tempFile.write(f'{key[0]}\t{key[1]}\t')
-                [tempFile.write(f'{intensity:.2f}\t') for intensity in mapData[key]]
-                tempFile.write('\n')
-        
-        # If mapData is given, the file is copied to the original directory
-        if not temp:
-            copy(f'{TEMP_PATH}/{map.orig}.txt', f'{map.directory}/{map.name}.txt')
+            map.name = name
+            map.revision += 1
             
+            # The cached average spectra is no longer valid
+            self.averages.invalidate(map)
+        return 0
+    
+    def setBusy(self, busy: bool):
+        ''' Disables the menu entries and buttons that start a process or change the maps while a job runs '''
+        state = 'disabled' if busy else 'normal'
+        
+        for label in ['Open map files', 'Save individual spectra', 'Save individual spectra as zip', 
+                      'Apply recipe to folder', 'Restore program settings']:
+            self.fileMenu.entryconfig(label, state = state)
+        self.viewMenu.entryconfig('Inspect map pixels', state = state)
+        
+        tabs = self.tabNotebook.allTabs
+        for button in [tabs.startTab.resetButton, tabs.shiftTab.btnApplyShift, tabs.cutTab.btnCutSave, 
+                       tabs.subtractTab.btnSubtract, tabs.fitTab.btnFitMap, self.legFrame.btnDelMap]:
+            button.config(state = state)
         return 0
     
     def mouseEvent(self, event):
@@ -423,24 +557,49 @@ class GUI(Tk):
         return 0
     
     def getAverageSpectra(self): 
-        ''' Reads current temp files and populates Averages instance '''
-        self.averages.clear()
+        ''' Populates Averages instance. Only the maps changed since their average
+            was last computed are read from the temp files '''
+        self.averages.update(self.maps, self.computeAverage)
+        return 0
+    
+    def computeAverage(self, map: Map):
+        ''' Reads the current temp file of the Map instance and returns its average spectra,
+            followed by the spectra statistics at each frequency and the frequency axis index '''
+        mapData = self.readMap(map)
         
-        for map in self.maps:
-            
-            mapData = self.readMap(map)
-            frequencies = mapData.pop('freq')
-            
-            # Add all the intensity lists for (x, y) keys from mapData
-            sumSpectra = np.zeros(len(frequencies))
-            for key in mapData:
-                sumSpectra += np.array(mapData[key])
+        # Get the average, deviation, extremes and percentiles in a single pass over the map
+        statistics = mapData.statistics()
+        
+        return [mapData.freq, statistics['mean'], statistics, mapData.axis]
+    
+    def plotAverages(self):
+        ''' Sets the average spectra of every map as the plotted averages '''
+        self.plotFrame.figure.setLines('averages', 
+                                       [(spectra[1][0], spectra[1][1], {'color': COLORS[col % len(COLORS)]}) 
+                                        for col, spectra in self.averages.enumerate()])
+        return 0
+    
+    def plotStatistics(self):
+        ''' If chosen by user, adds the standard deviation band and the median spectra
+            of each map to the plot '''
+        deviations = []
+        medians = []
+        for col, spectra in self.averages.enumerate():
+            frequencies, average, statistics = spectra[1][:3]
+            color = COLORS[col % len(COLORS)]
             
-            # Divide sum spectra to get average
-            avgSpectra = sumSpectra / len(mapData)
+            if self.varShowStd.get():
+                deviations.append((frequencies, 
+                                   average - statistics['std'], 
+                                   average + statistics['std'], 
+                                   {'color': color, 'alpha': 0.2, 'linewidth': 0}))
             
-            # Add the average spectra to Averages
-            self.averages.addSpectra(map, [frequencies, avgSpectra])
+            if self.varShowMedian.get():
+                medians.append((frequencies, statistics['percentiles'][50], 
+                                {'color': color, 'linestyle': '--'}))
+        
+        self.plotFrame.figure.setFills('deviations', deviations)
+        self.plotFrame.figure.setLines('medians', medians)
         return 0
     
     def configMenu(self):
@@ -453,6 +612,12 @@ class GUI(Tk):
                              command = self.saveAvgSpectra)
         filemenu.add_command(label = 'Save individual spectra', 
                              command = self.saveIndSpectra)
+        filemenu.add_command(label = 'Save individual spectra as zip', 
+                             command = partial(self.saveIndSpectra, True))
+        filemenu.add_command(label = 'Save recipe', 
+                             command = self.saveRecipe)
+        filemenu.add_command(label = 'Apply recipe to folder', 
+                             command = self.applyRecipe)
         filemenu.add_command(label = 'Restore program settings', 
                              command = self.resetGUI)
         filemenu.add_separator()
@@ -460,9 +625,25 @@ class GUI(Tk):
                              command = self.openAbout)
         filemenu.add_command(label = 'Exit', 
                              command = self.onClose)
+        
+        viewmenu = Menu(menubar, tearoff = 0)
+        viewmenu.add_checkbutton(label = 'Show standard deviation', 
+                                 variable = self.varShowStd, 
+                                 command = self.chooseDisplay)
+        viewmenu.add_checkbutton(label = 'Show median spectra', 
+                                 variable = self.varShowMedian, 
+                                 command = self.chooseDisplay)
+        viewmenu.add_separator()
+        viewmenu.add_command(label = 'Inspect map pixels', 
+                             command = self.inspectPixels)
 
         menubar.add_cascade(label = 'File', menu = filemenu)
+        menubar.add_cascade(label = 'View', menu = viewmenu)
         self.config(menu = menubar)
+        
+        # Kept to disable the processing entries while a job runs
+        self.fileMenu = filemenu
+        self.viewMenu = viewmenu
         return 0
     
     def configFrames(self):
@@ -486,5 +667,8 @@ class GUI(Tk):
         currentTab.displaySpectra()
     
 if __name__ == '__main__':
+    # Needed for the fitting worker processes in the frozen executable
+    freeze_support()
+    
     gui = GUI()
     gui.mainloop()
\ No newline at end of file
@@ -0,0 +1,210 @@
+import os
+import sys
+import argparse
+import tempfile
+from functools import partial
+from multiprocessing import freeze_support
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.Maps import Map
+from src.MapData import MapData
+from src.Recipe import Recipe, findMaps as findFolderMaps
+from src.Progress import Progress, ProgressTracker
+from src.FigureExport import setExportWorkers
+from src.Pipeline import (shiftSpectra, cutSpectra, subtractSpectra, fitMapSpectra, saveBaselineParameters,
+                          readBaselineParameters, readGuideFitParameters, mapParameters)
+
+# Seconds between the progress lines of each map
+REPORT_INTERVAL = 10
+
+def parseArguments(arguments: list = None):
+    ''' Reads the command line options '''
+    parser = argparse.ArgumentParser(description = 'Processes LabSpec6 maps without the graphical interface. '
+                                                   'The selected steps are applied in order: shift, cut, '
+                                                   'baseline subtraction and band fitting. '
+                                                   'Every step writes the same files as in HLAMPS.')
+    parser.add_argument('maps', nargs = '+',
+                        help = 'map .txt files, or folders with map files')
+    parser.add_argument('--shift', nargs = 2, type = float, metavar = ('X', 'Y'),
+                        help = 'shift the frequencies by X and the intensities by Y')
+    parser.add_argument('--cut', nargs = 2, type = float, metavar = ('START', 'END'),
+                        help = 'keep only the frequencies between START and END')
+    parser.add_argument('--baseline', metavar = 'FILE',
+                        help = 'subtract the baseline with the anchors of a BaselineParameters.txt file')
+    parser.add_argument('--baseline-figures', action = 'store_true',
+                        help = 'save the baseline and subtracted figures of each spectrum')
+    parser.add_argument('--fit', metavar = 'FILE',
+                        help = 'fit the bands of a GuideFitParams.txt file to every spectrum')
+    parser.add_argument('--fix', action = 'store_true',
+                        help = 'fix the band positions and decays in the fit')
+    parser.add_argument('--warm', action = 'store_true',
+                        help = 'start each fit from the results of its neighbouring pixels')
+    parser.add_argument('--store', action = 'store_true',
+                        help = 'save the fit results in a single file per map')
+    parser.add_argument('--fit-figures', action = 'store_true',
+                        help = 'save the fit figure of each spectrum')
+    parser.add_argument('--heatmap-figures', action = 'store_true',
+                        help = 'save the heatmap figure of each band')
+    parser.add_argument('--recipe', metavar = 'FILE',
+                        help = 'replay the steps of a recipe saved in HLAMPS, in a single pass over each map. '
+                               'It cannot be combined with the step options')
+    parser.add_argument('-j', '--workers', type = int,
+                        help = 'number of maps processed at once (default: one per processor, up to the number of maps)')
+    parser.add_argument('--fit-workers', type = int, default = 1,
+                        help = 'number of processes fitting the spectra of each map (default: 1)')
+    args = parser.parse_args(arguments)
+
+    # A recipe has its own steps and options, so the step options would be ignored
+    if args.recipe is not None:
+        steps = {'--shift': args.shift, '--cut': args.cut, '--baseline': args.baseline,
+                 '--baseline-figures': args.baseline_figures, '--fit': args.fit, '--fix': args.fix,
+                 '--warm': args.warm, '--store': args.store, '--fit-figures': args.fit_figures,
+                 '--heatmap-figures': args.heatmap_figures}
+        given = [option for option, value in steps.items() if value not in (None, False)]
+        if given:
+            parser.error(f'--recipe cannot be combined with {", ".join(given)}')
+    return parser, args
+
+def findMaps(paths: list, recipe: Recipe = None):
+    ''' Returns the map files in paths. Folders are replaced by the .txt files they contain,
+    leaving out the maps written by replaying the recipe, if given '''
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += findFolderMaps(path, recipe)
+        else:
+            filenames.append(path)
+    return [os.path.abspath(filename) for filename in filenames]
+
+def printProgress(name: str, progress: Progress):
+    ''' Progress callback, prints a line for the map '''
+    print(f'{name}: {progress.describe()}', flush = True)
+    return 0
+
+def createMap(map: Map, path: str, frequencies, coords):
+    ''' Returns an empty MapData for the next revision of the map, with its working copy in path '''
+    return MapData.create(f'{path}/{map.orig}_{map.revision + 1}', frequencies, coords)
+
+def writeMap(map: Map, mapData: MapData, previous: MapData, suffix: str):
+    ''' Writes the new revision of the map to its directory, with suffix added to the map name only once.
+    The working copy of the previous revision is removed '''
+    if suffix not in map.name:
+        map.name += suffix
+
+    mapData.spectra.flush()
+    mapData.toFile(f'{map.directory}/{map.name}.txt')
+    map.revision += 1
+
+    # It can still be in use in some platforms, in which case it is removed with the temporary folder
+    try:
+        os.remove(previous.spectraFile)
+    except OSError:
+        pass
+    return 0
+
+def processMap(filename: str, options: dict):
+    ''' Applies the chosen steps to a map and writes their results next to it. Returns the final map name '''
+    if options['recipe'] is not None:
+        return replayRecipe(filename, options)
+
+    directory, orig = os.path.split(filename[:-4])
+    map = Map(directory, orig, orig)
+
+    with tempfile.TemporaryDirectory() as path:
+        mapData = MapData.convertFile(filename, f'{path}/{map.orig}_{map.revision}')
+        map.spectraNum = len(mapData)
+
+        # Every step goes through all the spectra once
+        steps = sum(options[step] is not None for step in ('shift', 'cut', 'anchors', 'params'))
+        tracker = ProgressTracker(map.spectraNum * steps, partial(printProgress, map.orig), REPORT_INTERVAL)
+
+        if options['shift'] is not None:
+            shiftX, shiftY = options['shift']
+            shiftedData = createMap(map, path, mapData.freq + shiftX, mapData.coords)
+            shiftSpectra(mapData, shiftedData, shiftY, tracker.advance)
+            writeMap(map, shiftedData, mapData, '_shifted')
+            mapData = shiftedData
+
+        if options['cut'] is not None:
+            startIndex = int(mapData.axis.closest(options['cut'][0]))
+            endIndex = int(mapData.axis.closest(options['cut'][1])) + 1
+
+            cutData = createMap(map, path, mapData.freq[startIndex: endIndex], mapData.coords)
+            cutSpectra(mapData, cutData, startIndex, endIndex, tracker.advance)
+            writeMap(map, cutData, mapData, '_cut')
+            mapData = cutData
+
+        if options['anchors'] is not None:
+            subData = createMap(map, path, mapData.freq, mapData.coords)
+            subtractSpectra(mapData, subData, options['anchors'], map, options['baselineFigures'], tracker.advance)
+            writeMap(map, subData, mapData, '_subtracted')
+            saveBaselineParameters(map, options['anchors'])
+            mapData = subData
+
+        if options['params'] is not None:
+            fitMapSpectra(options['params'], mapData, map, options['fit'], options['fitWorkers'], tracker.advance)
+
+        # Release the working copy before the temporary folder is removed
+        del mapData
+    return map.name
+
+def replayRecipe(filename: str, options: dict):
+    ''' Applies the recipe to a map in a single pass and writes the results next to it. Returns the final map name '''
+    recipe = options['recipe']
+    name = os.path.basename(filename[:-4])
+
+    tracker = ProgressTracker(recipe.workload(MapData.readHeader(filename)[1]),
+                              partial(printProgress, name), REPORT_INTERVAL)
+    return recipe.apply(filename, options['fitWorkers'], tracker.advance)
+
+def main(arguments: list = None):
+    ''' Runs the command line interface. Returns the exit status '''
+    parser, args = parseArguments(arguments)
+
+    options = {'shift': args.shift,
+               'cut': args.cut,
+               'anchors': None,
+               'baselineFigures': args.baseline_figures,
+               'params': None,
+               'fit': {'store': args.store,
+                       'figures': args.fit_figures,
+                       'heatFigures': args.heatmap_figures,
+                       'warm': args.warm},
+               'fitWorkers': max(1, args.fit_workers),
+               'recipe': None}
+
+    # Parameter files are read once, before any map is processed
+    try:
+        if args.baseline is not None:
+            options['anchors'] = readBaselineParameters(args.baseline)
+        if args.fit is not None:
+            options['params'] = mapParameters(*readGuideFitParameters(args.fit), fix = args.fix)
+        if args.recipe is not None:
+            options['recipe'] = Recipe.load(args.recipe)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    filenames = findMaps(args.maps, options['recipe'])
+    if not filenames:
+        parser.error('no map files found')
+
+    workers = max(1, args.workers or min(len(filenames), os.cpu_count() or 1))
+
+    # Every map processed at once saves its figures from its own pool, so the processors are shared between them
+    exportWorkers = max(1, (os.cpu_count() or 1) // workers)
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers = workers, initializer = setExportWorkers,
+                             initargs = (exportWorkers,)) as executor:
+        futures = {executor.submit(processMap, filename, options): filename for filename in filenames}
+
+        for future in as_completed(futures):
+            try:
+                print(f'{futures[future]}: saved as {future.result()}', flush = True)
+            except Exception as error:
+                print(f'{futures[future]}: failed, {error}', file = sys.stderr, flush = True)
+                failed += 1
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    freeze_support()
+    sys.exit(main())
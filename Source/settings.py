@@ -6,11 +6,9 @@ if getattr(sys, 'frozen', False):
 else:
         INSTALL_DIR = os.path.dirname(os.path.abspath(__file__))
 
-print(INSTALL_DIR)
-
-os.chdir(INSTALL_DIR)
+# Folder of the working copies of the maps. Created by the GUI on startup,
+# so importing the settings has no side effects
 TEMP_PATH = f'{INSTALL_DIR}/temp'
-os.makedirs(TEMP_PATH, exist_ok = True)
 
 IMAGES = f'{INSTALL_DIR}/images'
 
@@ -34,7 +32,9 @@ LOGS = {'open':             'Maps loaded successfully',
         'shift':            'Shifted maps were saved', 
         'importfit':        'Band parameters imported successfully',
         'fitGuide':         'Guide spectra fitted',
-        'fitMap':           'Maps were fitted' }
+        'fitMap':           'Maps were fitted', 
+        'recipe_save':      'Processing recipe saved', 
+        'recipe':           'Processing recipe applied' }
 
 # Text for the About window
 ABOUT_TITLE = 'Horiba LabRam Automatic\nMap Processing Software\n'
@@ -1,5 +1,3 @@
-from tkinter.messagebox import showerror
-
 class Anchors:
     ''' Contains the baseline information for the spectra baseline correction '''
     def __init__(self):
@@ -22,13 +20,12 @@ class Anchors:
         return 0
         
     def delAnchor(self, anchor: float):
-        ''' Deletes an existing anchor, which is determined by the button that is pressed'''
+        ''' Deletes an existing anchor, which is determined by the button that is pressed.
+        Returns 1 for the frequency endpoints, which can't be deleted '''
         index = self.anchors.index(anchor)
         
         # Don't allow fot the frequency endpoins to be deleted
         if index == 0 or index == len(self.anchors) - 1:
-            showerror('Error', 
-                      'Cannot remove the spectra limits')
             return 1
         
         self.anchors.pop(index)
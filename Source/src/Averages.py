@@ -1,39 +1,73 @@
-from .Maps import Map
+from .Maps import Map, Maps
 
 class Averages:
-    ''' Contains average spectra for the current maps '''
+    ''' Contains average spectra for the current maps.
+    Each average is cached with the revision of the Map it was computed from
+    and is only recomputed after the map changes '''
     def __init__(self):
         self.averages = []
-    
+
+        # Map revision of each cached average, by original map name
+        self.revisions = {}
+
     def addSpectra(self, map: Map, spectraData: list):
-        ''' Adds a new average spectra '''
-        self.averages.append([map, spectraData])  
+        ''' Adds a new average spectra, replacing the previous one for the same map '''
+        self.invalidate(map)
+        self.averages.append([map, spectraData])
+        self.revisions[map.orig] = map.revision
         return 0
-        
+
     def getSpectra(self, map: Map):
         ''' Gets a spectrum data from the Map object '''
         for spectra in self.averages:
-            if map == spectra[0]:
+            if map.orig == spectra[0].orig:
                 return spectra[1]
         return None
-    
+
+    def isCurrent(self, map: Map):
+        ''' Checks if the cached average spectra for the Map object is up to date '''
+        return self.revisions.get(map.orig) == map.revision and self.getSpectra(map) is not None
+
+    def invalidate(self, map: Map):
+        ''' Removes the cached average spectra for the Map object '''
+        self.averages = [spectra for spectra in self.averages if spectra[0].orig != map.orig]
+        self.revisions.pop(map.orig, None)
+        return 0
+
+    def update(self, maps: Maps, compute):
+        ''' Sets the averages for maps, in order. compute(map) returns the spectra data
+        and is only called for maps without an up to date cached average '''
+        averages = []
+        for map in maps:
+            if self.isCurrent(map):
+                spectraData = self.getSpectra(map)
+            else:
+                spectraData = compute(map)
+            averages.append([map, spectraData])
+
+        # Deleted maps are dropped from the cache
+        self.averages = averages
+        self.revisions = {map.orig: map.revision for map in maps}
+        return 0
+
     def clear(self):
         ''' Clears the averages list'''
         self.averages.clear()
+        self.revisions.clear()
         return 0
-    
+
     def copy(self):
         ''' Returns a copy of the averages data '''
         return self.averages.copy()
-    
+
     def enumerate(self):
         ''' For enumeration '''
         return enumerate(self.averages)
-    
+
     def __iter__(self):
         ''' For iteration '''
         return iter(self.averages)
-    
+
     def __getitem__(self, index):
         ''' For subscription '''
-        return self.averages[index]
\ No newline at end of file
+        return self.averages[index]
@@ -1,11 +1,12 @@
-import os
+from .JobRunner import Job
 from functools import partial
+from .Pipeline import cutSpectra
 from idlelib.tooltip import Hovertip
 from tkinter.ttk import Frame, Notebook
-from settings import TEMP_PATH, COLORS, IMAGES
-from .Global_Functions import isNumber, findClosest
+from settings import IMAGES
+from .Global_Functions import isNumber
 from tkinter.messagebox import showerror, askyesno, showinfo
-from tkinter import StringVar, BooleanVar, Label, Entry, PhotoImage, Button
+from tkinter import Tk, StringVar, BooleanVar, Label, Entry, PhotoImage, Button
 
 class CutTab(Frame):
     ''' Contains variables and widgets for the Cut Spectra Tab '''
@@ -193,30 +194,53 @@ class CutTab(Frame):
         start = float(self.varInitCut.get())
         end = float(self.varFinCut.get())
         
+        # For potentially long processes, the progress bar in the Status Frame is used
+        total = self.window.maps.length() * self.window.maps[0].spectraNum
+        
+        # The maps are cut in the background. The maps saved before a cancellation are kept
+        saved = []
+        self.window.jobs.run('Saving cut maps', 
+                             partial(self.cutMaps, start, end, saved), 
+                             partial(self.finishCut, start, end, saved), 
+                             total, 
+                             partial(self.window.commitMaps, saved))
+        return 0
+    
+    def cutMaps(self, start: float, end: float, saved: list, job: Job):
+        ''' Saves the maps cut between the start and end frequencies, adding a (Map, name) tuple to saved for each one.
+        Runs in the background, so it does not use any widget or change the Map elements '''
         startIndex = None
         endIndex = None
         
         for map in self.window.maps:
-            os.chdir(map.directory)
-            
             # Load the map data
             mapData = self.window.readMap(map)
             
-            # Add a suffix to denote cut, but only once
-            if '_cut' not in map.name: 
-                map.name = map.name + '_cut'
-            
             # Define cut indexes if not defined
             if startIndex is None:
-                startIndex = findClosest(start, mapData['freq'])
-                endIndex = findClosest(end, mapData['freq']) + 1
+                startIndex = int(mapData.axis.closest(start))
+                endIndex = int(mapData.axis.closest(end)) + 1
+            
+            # Slice the frequencies and the spectra accoding to the indexes, one block at a time
+            cutData = self.window.createMap(map, mapData.freq[startIndex: endIndex], mapData.coords)
             
-            # For each key in the map data, slice the value accoding to the indexes
-            for key in mapData:
-                mapData[key] = mapData[key][startIndex: endIndex]
+            cutSpectra(mapData, cutData, startIndex, endIndex, job.progress)
+            
+            # Add a suffix to denote cut, but only once
+            name = map.name if '_cut' in map.name else map.name + '_cut'
             
             # Writes the new map data to the temp and original folder
-            self.window.writeMap(map, mapData)
+            self.window.writeMap(map, cutData, name)
+            saved.append((map, name))
+        return 0
+    
+    def finishCut(self, start: float, end: float, saved: list, result: int):
+        ''' Updates the Tab once the cut maps are saved '''
+        # Use the cut maps as the current ones
+        self.window.commitMaps(saved)
+        
+        # Record the step to replay it on other maps
+        self.window.recipe.add('cut', start = start, end = end)
         
         # Update legend to reflect new names
         self.window.legFrame.updateLegend()
@@ -231,7 +255,6 @@ class CutTab(Frame):
 
         showinfo('Save', 
                  'Cut maps saved successfully')
-        os.chdir(TEMP_PATH)
         return 0
     
     def clearLimit(self, index):
@@ -246,10 +269,10 @@ class CutTab(Frame):
             if self.selectOn.get():
                 self.initCut.config(bg = '#95CCD9')
                 self.finCut.config(bg = '#ffffff')
-        return 0
         
-        # Display new maps
-        self.displaySpectra()
+        # Display the remaining limit
+        self.displayLimits()
+        return 0
         
     def displaySpectra(self, window = None):
         ''' Displays the average spectra with specific need of the Cut Tab. '''
@@ -262,25 +285,47 @@ class CutTab(Frame):
         # Get the current average spectra
         window.getAverageSpectra()
         
-        # Reinitialize plot
-        plot = window.plotFrame.figure.reInitPlot()
+        # Start a new display, reusing the plotted lines
+        window.plotFrame.figure.startDisplay()
         
         # Plot the spectra
-        for col, spectra in window.averages.enumerate():  
-            plot.plot(spectra[1][0],spectra[1][1], 
-                      color = COLORS[col % len(COLORS)])
+        window.plotAverages()
+        
+        # Add the spectra statistics, if chosen by user
+        window.plotStatistics()
         
         # Show a vertical line for each collected limit
-        if self.varInitCut.get() != '':
-            plot.axvline(x = float(self.varInitCut.get()))
-        if self.varFinCut.get() != '':
-            plot.axvline(x = float(self.varFinCut.get()))
+        self.plotLimits(window)
 
+        window.plotFrame.figure.rescale()
         window.plotFrame.figure.saveLimits()
         window.plotFrame.figure.drawCanvas()
         
         # Display limits in status Frame
         self.window.statFrame.getLimits()
+    
+    def plotLimits(self, window: Tk = None):
+        ''' Sets a vertical line for each collected limit, as an overlay of the plot '''
+        if window is None:
+            window = self.window
+        
+        figure = window.plotFrame.figure
+        limits = [float(limit.get()) for limit in (self.varInitCut, self.varFinCut) if limit.get() != '']
+        
+        figure.setLines('cutLimits', 
+                        [([limit, limit], [0, 1], {'color': 'C0', 'transform': figure.plot1.get_xaxis_transform()}) 
+                         for limit in limits], 
+                        overlay = True)
+        return 0
+    
+    def displayLimits(self):
+        ''' Redraws only the vertical lines of the limits '''
+        if self.window.maps.isEmpty():
+            return 1
+        
+        self.plotLimits()
+        self.window.plotFrame.figure.updateOverlay()
+        return 0
 
     def handleMouseEvent(self, x: float, y: float):
         ''' Function triggered upon a mouse event on the plot, when the Cut tab is active. '''
@@ -299,5 +344,5 @@ class CutTab(Frame):
             self.initCut.config(bg = '#95CCD9')
             self.finCut.config(bg = '#ffffff')
         
-        self.displaySpectra()
+        self.displayLimits()
         return 0
@@ -0,0 +1,172 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of processes rendering figures at once, by default. Lowered with setExportWorkers
+# when several maps are processed at once, each with its own exporter
+EXPORT_WORKERS = os.cpu_count() or 1
+
+# Number of figures sent to a worker process at once
+BATCH_SIZE = 32
+
+# Figures of each worker process, by kind, reused for every figure of that kind
+workerFigures = {}
+
+def setExportWorkers(workers: int):
+    ''' Sets the default number of processes of the exporters created afterwards in this process '''
+    global EXPORT_WORKERS
+    EXPORT_WORKERS = max(1, workers)
+    return 0
+
+def initWorker():
+    ''' Runs once in each worker process. Figures are only saved to files, so no interactive backend is needed '''
+    import matplotlib
+    matplotlib.use('Agg')
+    return 0
+
+class ExportFigure:
+    ''' Figure with a single subplot whose lines are created once and updated with set_data for every spectrum '''
+    def __init__(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111, xlabel = 'Wavenumber (cm-1)', ylabel = 'Intensity')
+
+    def save(self, filename: str):
+        ''' Rescales the axes to the new data and saves the figure '''
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.fig.savefig(filename)
+        return 0
+
+class BaselineFigure(ExportFigure):
+    ''' Spectrum with its baseline as a line and the anchor points '''
+    def __init__(self):
+        super().__init__()
+        self.data, = self.ax.plot([], [], 'k')
+        self.baseline, = self.ax.plot([], [], c = 'grey')
+        self.anchors, = self.ax.plot([], [], ' o', c = 'grey')
+
+    def draw(self, filename: str, frequencies: np.ndarray, intensities: np.ndarray,
+             anchors: list, yAnchors: np.ndarray):
+        self.data.set_data(frequencies, intensities)
+        self.baseline.set_data(anchors, yAnchors)
+        self.anchors.set_data(anchors, yAnchors)
+        return self.save(filename)
+
+class SpectrumFigure(ExportFigure):
+    ''' A single spectrum, such as a subtracted one '''
+    def __init__(self):
+        super().__init__()
+        self.data, = self.ax.plot([], [], 'k')
+
+    def draw(self, filename: str, frequencies: np.ndarray, intensities: np.ndarray):
+        self.data.set_data(frequencies, intensities)
+        return self.save(filename)
+
+class FitFigure(ExportFigure):
+    ''' Spectrum with the total fit, each band and the baseline. Lines are created for numPeaks bands '''
+    def __init__(self, numPeaks: int):
+        super().__init__()
+        self.data, = self.ax.plot([], [], 'k')
+        self.fit, = self.ax.plot([], [], 'r', alpha = 0.8)
+        self.bands = [self.ax.plot([], [], alpha = 0.5)[0] for peak in range(numPeaks)]
+        self.baseline, = self.ax.plot([], [], alpha = 0.5)
+
+    def draw(self, filename: str, frequencies: np.ndarray, intensities: np.ndarray, fit: np.ndarray,
+             bandFits: list, baseline: np.ndarray):
+        self.data.set_data(frequencies, intensities)
+        self.fit.set_data(frequencies, fit)
+        for line, bandFit in zip(self.bands, bandFits):
+            line.set_data(frequencies, bandFit)
+        self.baseline.set_data(frequencies, baseline)
+        return self.save(filename)
+
+def renderFigures(kind: str, tasks: list):
+    ''' Draws and saves a batch of figures of one kind. Runs in a worker process, which keeps
+    its figures between batches. Each task has the filename and the data given to the draw method '''
+    if kind == 'fit':
+        # The fit figure has a line for each band
+        numPeaks = len(tasks[0][4])
+        key = (kind, numPeaks)
+        if key not in workerFigures:
+            workerFigures[key] = FitFigure(numPeaks)
+    else:
+        key = kind
+        if key not in workerFigures:
+            workerFigures[key] = {'baseline': BaselineFigure, 'spectrum': SpectrumFigure}[kind]()
+
+    figure = workerFigures[key]
+    for task in tasks:
+        figure.draw(*task)
+    return len(tasks)
+
+class FigureExporter:
+    ''' Saves the figures of many spectra from a pool of processes rendering with the Agg backend.
+    Each process reuses one figure of each kind and only updates its line data, instead of creating
+    a new figure for every spectrum. Figures are sent to the processes in batches of batchSize.
+    Kinds, with the data of each figure after the filename:
+    - baseline: frequencies, intensities, anchors and anchor intensities
+    - spectrum: frequencies and intensities
+    - fit: frequencies, intensities, total fit, a list with the fit of each band and the baseline
+    workers is the number of processes, EXPORT_WORKERS if not given.
+    To be used as a context manager, which waits for every figure to be saved '''
+    def __init__(self, workers: int = None, batchSize: int = BATCH_SIZE):
+        self.workers = EXPORT_WORKERS if workers is None else workers
+        self.batchSize = batchSize
+        self.executor = ProcessPoolExecutor(max_workers = self.workers, initializer = initWorker)
+        self.batches = {}
+        self.pending = []
+
+    def add(self, kind: str, filename: str, *data):
+        ''' Adds a figure to be saved as filename '''
+        batch = self.batches.setdefault(kind, [])
+        batch.append((filename, *(np.asarray(values) for values in data)))
+
+        if len(batch) >= self.batchSize:
+            self.submit(kind)
+        return 0
+
+    def submit(self, kind: str):
+        ''' Sends the figures of kind waiting in a batch to the worker processes '''
+        tasks = self.batches.pop(kind, [])
+        if not tasks:
+            return 0
+
+        # Only a few batches per process can be waiting, which bounds the memory used
+        while len(self.pending) >= 2 * self.workers:
+            self.pending.pop(0).result()
+
+        self.pending.append(self.executor.submit(renderFigures, kind, tasks))
+        return 0
+
+    def wait(self):
+        ''' Saves the figures still in a batch and waits for every figure, raising any error found while saving them '''
+        for kind in list(self.batches):
+            self.submit(kind)
+
+        for future in self.pending:
+            future.result()
+        self.pending = []
+        return 0
+
+    def close(self, cancel: bool = False):
+        ''' Finishes saving every figure. With cancel, the figures not saved yet are dropped '''
+        if cancel:
+            self.batches = {}
+            self.pending = []
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown(cancel_futures = cancel)
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, *exception):
+        # After an error or a cancellation there is no need to save the remaining figures
+        self.close(cancel = exceptionType is not None)
+        return False
@@ -0,0 +1,329 @@
+from __future__ import annotations
+import numpy as np
+from collections import deque
+from typing import TYPE_CHECKING
+from .Global_Functions import paramsVector, evaluateModel, evaluateJacobian
+from concurrent.futures import ProcessPoolExecutor
+
+# lmfit and scipy are slow to import, so they are imported by the functions that use them
+if TYPE_CHECKING:
+    from lmfit import Parameters
+
+# Number of spectra fitted together and sent to a worker process at once
+CHUNK_SIZE = 128
+
+# Number of spectra fitted together when only the linear parameters vary
+LINEAR_CHUNK_SIZE = 2048
+
+# Grid strides of the successive waves of a warm started fit
+WARM_STRIDES = (4, 2, 1)
+
+# Stopping criteria of the batched fit, as in lmfit leastsq
+MAX_ITERATIONS = 200
+TOLERANCE = 1.5e-8
+
+def cost(params: Parameters, yData: np.ndarray, xData: np.ndarray):
+    ''' Cost function to be minimized by lmfit
+
+    - params: Initial guess for the fit. Contains Parameter instances to be used for the model
+
+    - yData: intensity values for the model to be compared to
+
+    - xData: frequency array to be computed in the creation of the model
+    '''
+    yModel = evaluateModel(xData, paramsVector(params))
+    return yData - yModel
+
+def jacobian(params: Parameters, yData: np.ndarray, xData: np.ndarray):
+    ''' Analytic Jacobian of the cost function, used by lmfit instead of finite differences.
+    Has a column for each varying parameter, in the order lmfit expects '''
+    vary = [param.vary for param in params.values()]
+    return -evaluateJacobian(xData, paramsVector(params))[:, vary]
+
+def fitSpectrum(params: Parameters, intensities: np.ndarray, frequencies: np.ndarray):
+    ''' Fits a single spectrum starting from params. Returns the lmfit MinimizerResult '''
+    # Converted once here rather than on every cost evaluation
+    frequencies = np.asarray(frequencies, dtype = float)
+    
+    from lmfit import Minimizer
+    
+    minner = Minimizer(cost, params,
+                       fcn_args = (intensities, frequencies))
+    return minner.minimize(Dfun = jacobian)
+
+def fitBatch(params: Parameters, frequencies: np.ndarray, spectra: np.ndarray, start: np.ndarray = None,
+             maxIterations: int = MAX_ITERATIONS, tolerance: float = TOLERANCE):
+    ''' Fits every spectrum in spectra starting from params, all at once.
+    start optionally gives a different parameter vector to start each spectrum from, shape (n_spectra, n_params).
+    Each iteration takes a bounded Levenberg-Marquardt step for every spectrum still being fitted,
+    as a single vectorized operation over the stacked spectra. Parameters at one of their bounds
+    are held there while the gradient points out of it. Returns a MinimizerResult for each spectrum,
+    as fitSpectrum does '''
+    frequencies = np.asarray(frequencies, dtype = float)
+    spectra = np.asarray(spectra, dtype = float)
+    
+    vary = np.array([param.vary for param in params.values()])
+    lower = np.array([param.min for param in params.values()])[vary]
+    upper = np.array([param.max for param in params.values()])[vary]
+    
+    if start is None:
+        values = np.tile(paramsVector(params), (len(spectra), 1))
+    else:
+        values = np.array(start, dtype = float)
+    values[:, vary] = np.clip(values[:, vary], lower, upper)
+    
+    residual = spectra - evaluateModel(frequencies, values)
+    chisqr = (residual ** 2).sum(axis = 1)
+    nfev = np.ones(len(spectra), dtype = int)
+    
+    damping = np.full(len(spectra), 1e-3)
+    active = np.ones(len(spectra), dtype = bool)
+    diagonal = np.arange(vary.sum())
+    
+    for iteration in range(maxIterations):
+        index = np.flatnonzero(active)
+        if len(index) == 0:
+            break
+        
+        current = values[index]
+        jacobian = evaluateJacobian(frequencies, current)[..., vary]
+        
+        # Normal equations of every spectrum, shapes (n, n_vary, n_vary) and (n, n_vary)
+        curvature = np.matmul(jacobian.transpose(0, 2, 1), jacobian)
+        gradient = np.einsum('nij,ni->nj', jacobian, residual[index])
+        
+        # Hold parameters at a bound if the step would leave it
+        held = (((current[:, vary] <= lower) & (gradient < 0))
+                | ((current[:, vary] >= upper) & (gradient > 0)))
+        free = ~held
+        curvature *= free[:, :, None] * free[:, None, :]
+        gradient *= free
+        
+        # Damp the step, scaled by the curvature. Parameters without any effect on the model are not moved
+        scale = curvature[:, diagonal, diagonal]
+        scale = np.maximum(scale, 1e-15 * scale.max(axis = 1, keepdims = True) + 1e-300)
+        curvature[:, diagonal, diagonal] += damping[index, None] * scale + held
+        
+        step = np.linalg.solve(curvature, gradient[..., None])[..., 0]
+        
+        trial = current.copy()
+        trial[:, vary] = np.clip(current[:, vary] + step, lower, upper)
+        trialResidual = spectra[index] - evaluateModel(frequencies, trial)
+        trialChisqr = (trialResidual ** 2).sum(axis = 1)
+        nfev[index] += 1
+        
+        # Accept the steps that reduce chi-square and relax their damping, increase it for the others
+        improved = trialChisqr < chisqr[index]
+        reduction = chisqr[index] - trialChisqr
+        
+        values[index[improved]] = trial[improved]
+        residual[index[improved]] = trialResidual[improved]
+        chisqr[index[improved]] = trialChisqr[improved]
+        damping[index] = np.where(improved, np.maximum(damping[index] / 10, 1e-12), damping[index] * 10)
+        
+        # Stop when chi-square or the parameters no longer change, or the damping can't find a better step
+        change = np.abs(trial - current)[:, vary]
+        converged = ((improved & (reduction <= tolerance * chisqr[index]))
+                     | np.all(change <= tolerance * (np.abs(current[:, vary]) + tolerance), axis = 1)
+                     | (damping[index] > 1e16))
+        active[index[converged]] = False
+    
+    return [createResult(params, vary, frequencies, *fit)
+            for fit in zip(values, residual, chisqr, nfev, ~active)]
+
+def createResult(params: Parameters, vary: np.ndarray, frequencies: np.ndarray, values: np.ndarray,
+                 residual: np.ndarray, chisqr: float, nfev: int, success: bool):
+    ''' Creates a MinimizerResult for a spectrum fitted by fitBatch, with the same statistics
+    and uncertainties lmfit leastsq reports, so it can be used with fit_report '''
+    from lmfit.minimizer import MinimizerResult
+    
+    result = MinimizerResult()
+    result.params = params.copy()
+    
+    for param, value in zip(result.params.values(), values):
+        param.value = value
+    
+    result.var_names = [name for name, param in result.params.items() if param.vary]
+    result.init_vals = [params[name].value for name in result.var_names]
+    result.method = 'batched leastsq'
+    result.nfev = int(nfev)
+    result.success = success
+    result.aborted = False
+    result.message = 'Fit succeeded.' if success else 'Maximum number of iterations reached.'
+    result.residual = residual
+    
+    result.ndata = len(residual)
+    result.nvarys = len(result.var_names)
+    result.nfree = result.ndata - result.nvarys
+    result.chisqr = float(chisqr)
+    result.redchi = chisqr / max(1, result.nfree)
+    
+    # Same information criteria as lmfit
+    logLikelihood = result.ndata * np.log(max(chisqr, 1e-250) / result.ndata)
+    result.aic = logLikelihood + 2 * result.nvarys
+    result.bic = logLikelihood + np.log(result.ndata) * result.nvarys
+    
+    # Uncertainties from the covariance matrix, if it can be estimated
+    jacobian = evaluateJacobian(frequencies, values)[:, vary]
+    try:
+        result.covar = np.linalg.inv(jacobian.T @ jacobian) * result.redchi
+        with np.errstate(invalid = 'ignore'):
+            stderr = np.sqrt(np.diag(result.covar))
+        result.errorbars = bool(np.all(np.isfinite(stderr)) and np.all(stderr > 0))
+    except np.linalg.LinAlgError:
+        result.covar = None
+        result.errorbars = False
+    
+    if result.errorbars:
+        correlation = result.covar / np.outer(stderr, stderr)
+        for i, name in enumerate(result.var_names):
+            result.params[name].stderr = stderr[i]
+            result.params[name].correl = {other: correlation[i, j]
+                                          for j, other in enumerate(result.var_names) if j != i}
+    
+    return result
+
+def isLinear(params: Parameters):
+    ''' Checks if only the baseline and band heights vary in params.
+    The model is then linear in the varying parameters '''
+    return all(name in ('offset', 'slope') or name.startswith('h')
+               for name, param in params.items() if param.vary)
+
+def fitLinear(params: Parameters, frequencies: np.ndarray, spectra: np.ndarray):
+    ''' Fits every spectrum in spectra when only the baseline and band heights vary.
+    The fixed band shapes form a design matrix, built once, and all spectra are solved
+    with a single linear least squares product. Spectra whose solution is out of bounds,
+    usually negative heights, are solved again with bounded least squares.
+    Returns a MinimizerResult for each spectrum, as fitSpectrum does '''
+    from scipy.optimize import lsq_linear
+
+    frequencies = np.asarray(frequencies, dtype = float)
+    spectra = np.asarray(spectra, dtype = float)
+    
+    vary = np.array([param.vary for param in params.values()])
+    lower = np.array([param.min for param in params.values()])[vary]
+    upper = np.array([param.max for param in params.values()])[vary]
+    
+    # The Jacobian columns of linear parameters are the model terms they multiply
+    start = paramsVector(params)
+    design = evaluateJacobian(frequencies, start)[:, vary]
+    
+    # Model of the fixed parameters alone
+    start[vary] = 0
+    data = spectra - evaluateModel(frequencies, start)
+    
+    coefficients = data @ np.linalg.pinv(design).T
+    
+    for index in np.flatnonzero(np.any((coefficients < lower) | (coefficients > upper), axis = 1)):
+        coefficients[index] = lsq_linear(design, data[index], bounds = (lower, upper), method = 'bvls').x
+    
+    values = np.tile(start, (len(spectra), 1))
+    values[:, vary] = coefficients
+    residual = data - coefficients @ design.T
+    
+    return [createResult(params, vary, frequencies, fitValues, fitResidual, (fitResidual ** 2).sum(), 1, True)
+            for fitValues, fitResidual in zip(values, residual)]
+
+def fitWarm(params: Parameters, frequencies: np.ndarray, spectra: np.ndarray, grid: np.ndarray):
+    ''' Fits spectra in waves, starting each spectrum from the closest spectrum already fitted.
+    grid is the (row, column) position of each spectrum in the map, as returned by MapData.gridIndex.
+    The first wave fits every fourth row and column from params, and the next ones
+    every second and every row and column, so most spectra start from a converged neighbour.
+    Rows and columns are counted from the first spectrum, so the first wave always has it,
+    whatever the part of the map the spectra come from.
+    Returns a MinimizerResult for each spectrum, as fitSpectrum does '''
+    results = [None] * len(spectra)
+    values = np.tile(paramsVector(params), (len(spectra), 1))
+    fitted = np.zeros(len(spectra), dtype = bool)
+    
+    # Grid positions relative to the first spectrum, which starts the first wave
+    relative = grid - grid[0]
+    
+    for stride in WARM_STRIDES:
+        wave = np.flatnonzero(~fitted & np.all(relative % stride == 0, axis = 1))
+        if len(wave) == 0:
+            continue
+        
+        # Start from the closest fitted spectrum in the grid
+        if fitted.any():
+            done = np.flatnonzero(fitted)
+            distance = ((grid[wave, None] - grid[None, done]) ** 2).sum(axis = 2)
+            values[wave] = values[done[distance.argmin(axis = 1)]]
+        
+        for index, result in zip(wave, fitBatch(params, frequencies, spectra[wave], values[wave])):
+            results[index] = result
+            values[index] = paramsVector(result.params)
+        
+        fitted[wave] = True
+    
+    return results
+
+def warmChunks(grid: np.ndarray, chunkSize: int):
+    ''' Splits the spectra into chunks of at most chunkSize consecutive spectra for warm started fits.
+    Chunks hold whole rows of the map, or part of a single row when rows are longer than chunkSize,
+    so the waves of fitWarm spread evenly over every chunk '''
+    if len(grid) == 0:
+        return
+    
+    # Pieces of at most chunkSize spectra of a single row
+    rowStarts = np.flatnonzero(np.diff(grid[:, 0]) != 0) + 1
+    pieces = []
+    for rowStart, rowEnd in zip(np.r_[0, rowStarts], np.r_[rowStarts, len(grid)]):
+        pieces += [(start, min(start + chunkSize, rowEnd)) for start in range(rowStart, rowEnd, chunkSize)]
+    
+    # Consecutive pieces are joined while they fit in a chunk
+    start, end = pieces[0]
+    for pieceStart, pieceEnd in pieces[1:]:
+        if pieceEnd - start > chunkSize:
+            yield slice(start, end)
+            start = pieceStart
+        end = pieceEnd
+    yield slice(start, end)
+
+def fitChunk(params: Parameters, frequencies: np.ndarray, spectra: np.ndarray, grid: np.ndarray = None):
+    ''' Fits consecutive spectra together. Runs in the worker processes.
+    If the grid positions of the spectra are given, the fit is warm started from neighbours '''
+    if isLinear(params):
+        return fitLinear(params, frequencies, spectra)
+    if grid is not None:
+        return fitWarm(params, frequencies, spectra, grid)
+    return fitBatch(params, frequencies, spectra)
+
+def fitSpectra(params: Parameters, frequencies: np.ndarray, spectra: np.ndarray, workers: int = 1,
+               grid: np.ndarray = None):
+    ''' Fits every spectrum in spectra starting from params, yielding the results in map order.
+    With more than one worker, the spectra are distributed in chunks across a pool of processes.
+    If grid, the (row, column) position of each spectrum, is given, the spectra of each chunk,
+    consecutive spectra of the map, are warm started from their already fitted neighbours in the chunk.
+    Chunks then hold whole map rows, or part of a single row, as split by warmChunks.
+    Only a few chunks per worker are in flight at once, so memory-mapped spectra are never fully loaded. '''
+    chunkSize = LINEAR_CHUNK_SIZE if isLinear(params) else CHUNK_SIZE
+    if grid is None:
+        chunks = (slice(start, start + chunkSize) for start in range(0, len(spectra), chunkSize))
+    else:
+        chunks = warmChunks(grid, chunkSize)
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from fitChunk(params, frequencies, np.asarray(spectra[chunk]),
+                                None if grid is None else grid[chunk])
+        return
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        pending = deque()
+
+        try:
+            for chunk in chunks:
+                pending.append(executor.submit(fitChunk, params, frequencies, np.asarray(spectra[chunk]),
+                                               None if grid is None else grid[chunk]))
+
+                # Wait for the oldest chunk to keep the results in order and bound the chunks in flight
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # If the results stop being used, the chunks not started yet are not fitted
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,82 @@
+import json
+import numpy as np
+
+class FitResults:
+    ''' Contains the fit results of every spectrum in a map as arrays, to be stored in a single .npz file
+    instead of a report and a fit file for each spectrum.
+    - freq: frequency values, shape (n_freq,)
+    - coords: (x, y) coordinates of each spectrum, shape (n_spectra, 2)
+    - names: parameter names, in the order of the parameter columns
+    - values, stderr: best fit values and standard errors, shape (n_spectra, n_params).
+    Standard errors that could not be estimated are NaN
+    - statistics: fit statistics of each spectrum, by name ('chisqr', 'redchi', 'aic', 'bic', 'nfev', 'success')
+    - metadata: any extra information about the map, stored with the results '''
+    STATISTICS = ('chisqr', 'redchi', 'aic', 'bic', 'nfev', 'success')
+
+    def __init__(self, freq: np.ndarray, coords: np.ndarray, names: list):
+        self.freq = np.asarray(freq, dtype = float)
+        self.coords = np.asarray(coords, dtype = str)
+        self.names = list(names)
+
+        self.values = np.full((len(coords), len(names)), np.nan)
+        self.stderr = np.full((len(coords), len(names)), np.nan)
+        self.statistics = {name: np.full(len(coords), np.nan) for name in self.STATISTICS}
+        self.metadata = {}
+
+    def add(self, index: int, result):
+        ''' Stores the MinimizerResult of the spectrum at index '''
+        for column, name in enumerate(self.names):
+            param = result.params[name]
+            self.values[index, column] = param.value
+            if param.stderr is not None:
+                self.stderr[index, column] = param.stderr
+
+        for name in self.STATISTICS:
+            self.statistics[name][index] = getattr(result, name)
+        return 0
+
+    def heights(self):
+        ''' Returns the fitted height of each band for every spectrum, shape (n_spectra, n_bands) '''
+        return self.values[:, [column for column, name in enumerate(self.names) if name.startswith('h')]]
+
+    def mapIntensities(self):
+        ''' Returns the band heights rounded to two decimals by (x, y) key, as used for the heatmaps '''
+        return {(x, y): np.round(heights, 2).tolist() for (x, y), heights in zip(self.coords, self.heights())}
+
+    def save(self, filename: str, metadata: dict = None):
+        ''' Writes the results to a single .npz file, with metadata stored as json '''
+        arrays = {'metadata': json.dumps({**self.metadata, **(metadata or {})}),
+                  'freq': self.freq,
+                  'coords': self.coords,
+                  'names': np.array(self.names),
+                  'values': self.values,
+                  'stderr': self.stderr,
+                  **self.statistics}
+
+        np.savez_compressed(filename, **arrays)
+        return 0
+
+    @classmethod
+    def load(cls, filename: str):
+        ''' Reads the results written by save '''
+        with np.load(filename) as file:
+            results = cls(file['freq'], file['coords'], file['names'].tolist())
+            results.values = file['values']
+            results.stderr = file['stderr']
+            results.statistics = {name: file[name] for name in cls.STATISTICS}
+            results.metadata = json.loads(str(file['metadata']))
+        return results
+
+    @classmethod
+    def concatenate(cls, parts: list):
+        ''' Joins the results of consecutive parts of a map, in order, into the results of the whole map '''
+        results = cls(parts[0].freq, np.concatenate([part.coords for part in parts]), parts[0].names)
+        results.values = np.concatenate([part.values for part in parts])
+        results.stderr = np.concatenate([part.stderr for part in parts])
+        results.statistics = {name: np.concatenate([part.statistics[name] for part in parts]) for name in cls.STATISTICS}
+        results.metadata = parts[0].metadata
+        return results
+
+    def __len__(self):
+        ''' Number of spectra in the results '''
+        return len(self.coords)
@@ -1,15 +1,23 @@
+from __future__ import annotations
 import os
 import numpy as np
+from typing import TYPE_CHECKING
 from .Maps import Map
-from settings import COLORS
-import matplotlib.pyplot as plt
 from idlelib.tooltip import Hovertip
 from .Bands import Band, Bands, FitBaseline
-from .Global_Functions import calculateModel
+from .JobRunner import Job
+from functools import partial
+from .FitResults import FitResults
+from .FitEngine import fitSpectrum
+from .Global_Functions import isNumber, calculateModel
+from .Pipeline import readGuideFitParameters, mapParameters, fitMapSpectra, writeHeatmaps
 from tkinter.filedialog import askopenfilename
-from lmfit import Parameters, Minimizer, fit_report
 from tkinter.messagebox import showinfo, showwarning, askyesno, showerror
-from tkinter import Tk, ttk, StringVar, BooleanVar, Canvas, Frame, Label, Button, Checkbutton
+from tkinter import Tk, ttk, StringVar, BooleanVar, Canvas, Frame, Label, Entry, Button, Checkbutton
+
+# lmfit is imported when first needed, as it is slow to import and delays the program start
+if TYPE_CHECKING:
+    from lmfit import Parameters
 
 class FitTab(ttk.Frame):
     ''' Contains all variables and widgets of the Fit Spectra Tab '''
@@ -23,7 +31,10 @@ class FitTab(ttk.Frame):
         self.varChkFix = BooleanVar(value = False)
         self.varChkFitFig = BooleanVar(value = False)
         self.varChkSaveHeat = BooleanVar(value = False)
+        self.varChkWarm = BooleanVar(value = False)
+        self.varChkStore = BooleanVar(value = False)
         self.varChkInstructions = BooleanVar(value = False)
+        self.varWorkers = StringVar(value = str(os.cpu_count()))
 
         self.configureLayout()
     
@@ -33,6 +44,8 @@ class FitTab(ttk.Frame):
         self.varChkFix.set(False)
         self.varChkFitFig.set(False)
         self.varChkSaveHeat.set(False)
+        self.varChkWarm.set(False)
+        self.varChkStore.set(False)
         self.varChkInstructions.set(False)
         self.fitBase.clearBase()
         self.fitBands.clearBands()
@@ -124,6 +137,10 @@ class FitTab(ttk.Frame):
                                 command = self.fitMap)
         self.btnFitMap.grid(column = 5, row = 0, sticky = 'w')
         
+        self.btnLoadResults = Button(self.tabFitBandsButtons, text = 'Load results', 
+                                     command = self.loadResults)
+        self.btnLoadResults.grid(column = 5, row = 1, sticky = 'w')
+        
         self.chkFixBase = Checkbutton(self.tabFitBandsButtons, text = 'Fix position and decay', 
                                       variable = self.varChkFix)
         self.chkFixBase.grid(column = 6, row = 0, sticky = 'w')
@@ -136,6 +153,20 @@ class FitTab(ttk.Frame):
                                        variable = self.varChkSaveHeat)
         self.chkSaveHeat.grid(column = 8, row = 0, sticky = 'w')
         
+        self.chkStore = Checkbutton(self.tabFitBandsButtons, text = 'Single results file', 
+                                    variable = self.varChkStore)
+        self.chkStore.grid(column = 6, row = 1, sticky = 'w')
+        
+        self.chkWarm = Checkbutton(self.tabFitBandsButtons, text = 'Warm start', 
+                                   variable = self.varChkWarm)
+        self.chkWarm.grid(column = 9, row = 0, sticky = 'w')
+        
+        Label(self.tabFitBandsButtons, text = 'Workers: ').grid(column = 10, row = 0, sticky = 'e')
+        self.entryWorkers = Entry(self.tabFitBandsButtons, textvariable = self.varWorkers, 
+                                  width = 4, validate = 'all', 
+                                  validatecommand = (self.register(isNumber), '%P'))
+        self.entryWorkers.grid(column = 11, row = 0, sticky = 'w')
+        
         Hovertip(self.btnShowFitBase, 
                  'Show current baseline and bands', 
                  hover_delay = 1000)
@@ -154,6 +185,9 @@ class FitTab(ttk.Frame):
         Hovertip(self.btnFitMap, 
                  'Fits all maps with the parameters from average fit', 
                  hover_delay = 1000)
+        Hovertip(self.btnLoadResults, 
+                 'Generates the heatmaps of a saved results file', 
+                 hover_delay = 1000)
         Hovertip(self.chkFixBase, 
                  'If not, allows them to move +- 3 for flexibility', 
                  hover_delay = 1000)
@@ -163,6 +197,15 @@ class FitTab(ttk.Frame):
         Hovertip(self.chkSaveHeat, 
                  'Generates heat maps for each band in each map', 
                  hover_delay = 1000)
+        Hovertip(self.chkStore, 
+                 'Saves the fits of each map in a single file instead of a report and a fit file for each spectra', 
+                 hover_delay = 1000)
+        Hovertip(self.chkWarm, 
+                 'Starts each spectrum fit from an already fitted neighbour', 
+                 hover_delay = 1000)
+        Hovertip(self.entryWorkers, 
+                 'Number of processes used to fit the maps', 
+                 hover_delay = 1000)
         
         Checkbutton(self.tabFitBaseline, text = 'Show\ninstructions', 
                     variable = self.varChkInstructions
@@ -211,8 +254,8 @@ class FitTab(ttk.Frame):
         
         self.varSelectedBand.set('B0')
         
-        # Display the spectra with the current Bands
-        self.displaySpectra()
+        # Display the current Bands
+        self.displayFit()
         
         return 0
     
@@ -253,6 +296,7 @@ class FitTab(ttk.Frame):
         # If it is not given, use all non empty Band elements
         if bandCreate == {}: bandCreate = self.fitBands.bandDict() 
         
+        from lmfit import Parameters
         params = Parameters()
         
         # Add linear baseline parameters with corresponding fix parameter statuses
@@ -278,18 +322,6 @@ class FitTab(ttk.Frame):
 
         return params
     
-    def cost(self, params: Parameters, yData: list, xData: list):
-        ''' Cost function to be minimized by lmfit
-        
-        - params: Initial guess for the fit. Contains Parameter instances to be used for the model
-        
-        - yData: intensity values for the model to be compared to
-        
-        - xData: frequency values to be computed in the creation of the model
-        '''
-        yModel = calculateModel(params, xData)
-        return yData - yModel
-    
     def importBands(self):
         ''' Import Band elements used in a previous fit by this program.
         The valid import files are created by the fit_report function in lmfit package. '''
@@ -309,57 +341,21 @@ class FitTab(ttk.Frame):
                                    initialdir = '/', 
                                    filetypes = (('Text files', '*.txt'),))
     
-        with open(filename, 'r') as file:
-            lines = file.readlines()
-        
-        # List of parameter values to be imported
-        toImport = []
-        
-        # Due to variability of the file length, we need to check for specific lines,
-        # between which the Band parameters are located
-        startIndex = None
-        endIndex = None
-        for line in lines:
-            if 'Variables' in line:
-                startIndex = lines.index(line) + 1
-            elif 'Correlations' in line:
-                endIndex = lines.index(line)
-        
-        # Check if the file format is correct; both startIndex and endIndex must be changed
-        if startIndex is None or endIndex is None:
+        try:
+            offset, slope, bands = readGuideFitParameters(filename)
+        except ValueError as error:
             showerror('Wrong file type',
-                                'Selected file is not the right' + 
-                                ' format for parameter import\n' +
-                                'File must be the result of a guide fit')
-            return 1
-
-        # Slice the file to include only the parameter section
-        lines = lines[startIndex: endIndex]
-        
-        # Check for each remaining line, which parameter it corresponds to
-        for line in lines:
-            lineSplit = line.split()
-            if 'offset' in lineSplit[0]:
-                offset = round(float(lineSplit[1]), 2)
-            elif 'slope' in lineSplit[0]:
-                slope = round(float(lineSplit[1]), 2)
-            elif 'x' in lineSplit[0] or 'd' in lineSplit[0] or 'h' in lineSplit[0]:
-                toImport.append(round(float(lineSplit[1]),2))    
-        
-        # Check for error importing
-        if toImport == [] or len(toImport) % 3 != 0:
-            showerror('No parameters',
-                      'No parameters to import or incorrect number of parameters to import')
+                      'Selected file is not the right format for parameter import\n' + str(error))
             return 1
-
-        # Get chunks of three parameters from toImport, corresponding to a Band element
-        for i in range(0, len(toImport), 3):
+        
+        # Add a Band element for each (position, decay, intensity) tuple
+        for position, decay, intensity in bands:
             bandNum = self.fitBands.getLength()
             self.addBand()
             
-            self.fitBands.band(f'B{bandNum}').setPos(toImport[i])
-            self.fitBands.band(f'B{bandNum}').setDec(toImport[i + 1])
-            self.fitBands.band(f'B{bandNum}').setInt(toImport[i + 2])
+            self.fitBands.band(f'B{bandNum}').setPos(position)
+            self.fitBands.band(f'B{bandNum}').setDec(decay)
+            self.fitBands.band(f'B{bandNum}').setInt(intensity)
         
         # Set linear baseline parameters
         self.fitBase.setOffset(offset)
@@ -402,9 +398,7 @@ class FitTab(ttk.Frame):
         frequencies = self.window.averages[index][1][0]
         
         # Performs minimization of cost function
-        minner = Minimizer(self.cost, params, 
-                           fcn_args = (intensities, frequencies))
-        result = minner.minimize()
+        result = fitSpectrum(params, intensities, frequencies)
         bestParams = result.params
         v = bestParams.valuesdict()
         
@@ -450,6 +444,8 @@ class FitTab(ttk.Frame):
     def saveFitParameters(self, mapIndex: int, result):
         ''' Save the accepted fit parameters to a file for future reference and import. 
         For each of the currently analyzed maps, write a fit_report output in each folder. '''
+        from lmfit import fit_report
+        
         for map in self.window.maps:
             os.chdir(map.directory)
             
@@ -461,44 +457,14 @@ class FitTab(ttk.Frame):
         return 0
         
     def createMapParams(self):
-        '''bandCreate is a dict returned from .bandDict() method in Bandas class, where each value a Band instance.
+        ''' Creates the initial parameters of the map fit from the current Band elements.
         Differs from createGuideParams in that it doesn't allow for full variation of positions and decays. '''
-        # Get the current Bands element
-        bandCreate = self.fitBands.bandDict()
-        params = Parameters()
-        
-        # Add current linear baseline parameters
-        params.add('offset', value = float(self.fitBase.getOffset()))
-        params.add('slope', value = float(self.fitBase.getSlope()))
-        
         # No need to check for empty bands, as the program only allows to fit the maps 
         # if no changes were made after last average fit
-        for bandNum, band in enumerate(bandCreate.values()):
-            # If position and decay fix Chechbutton True, vary = False for those parameters
-            if self.varChkFix.get():
-                params.add(f'x{bandNum}', 
-                           value = float(band.getPos()), 
-                           vary = False)
-                params.add(f'd{bandNum}', 
-                           value = float(band.getDec()), 
-                           vary = False)
-                params.add(f'h{bandNum}', 
-                           value = float(band.getInt()), 
-                           min = 0)
-            # If not, allow a +- 3 in each parameter to accomodate inhomogeneity
-            else:
-                params.add(f'x{bandNum}', 
-                           value = float(band.getPos()), 
-                           min = float(band.getPos()) - 3, 
-                           max = float(band.getPos()) + 3)
-                params.add(f'd{bandNum}', 
-                           value = float(band.getDec()),
-                           min = float(band.getDec()) - 3, 
-                           max = float(band.getDec()) + 3)
-                params.add(f'h{bandNum}', 
-                           value = float(band.getInt()), 
-                           min = 0)
-        return params
+        bands = [(band.getPos(), band.getDec(), band.getInt()) for band in self.fitBands.bandDict().values()]
+        
+        # If position and decay fix Chechbutton True, vary = False for those parameters
+        return mapParameters(self.fitBase.getOffset(), self.fitBase.getSlope(), bands, self.varChkFix.get())
     
     def fitMap(self):
         ''' Fit all spectra in a map using the result of the average spectra fit. '''
@@ -513,65 +479,46 @@ class FitTab(ttk.Frame):
             return 1
         
         params = self.createMapParams()
-        numPeaks = self.fitBands.getLength()
+        
+        # Number of processes used for fitting
+        workers = max(1, int(float(self.varWorkers.get() or 1)))
         
         # Activate the progress bar in Status Frame to show progress to user 
         # and avoid panic
-        progressStep = 300 / (self.window.maps.length() * self.window.maps[0].spectraNum)
-        self.window.statFrame.progressLabel.config(text = 'Processing:   Fitting spectra')
-        
+        total = self.window.maps.length() * self.window.maps[0].spectraNum
+        
+        # Options chosen by user
+        options = {'store': self.varChkStore.get(), 
+                   'figures': self.varChkFitFig.get(), 
+                   'heatFigures': self.varChkSaveHeat.get(), 
+                   'warm': self.varChkWarm.get()}
+        
+        # The maps are fitted in the background
+        self.window.jobs.run('Fitting spectra', 
+                             partial(self.fitMaps, params, workers, options), 
+                             partial(self.finishFitMap, params, self.varChkFix.get(), options), 
+                             total)
+        return 0
+    
+    def fitMaps(self, params: Parameters, workers: int, options: dict, job: Job):
+        ''' Fits every map and writes the results. Runs in the background, so it does not use any widget '''
         for map in self.window.maps:
-            
-            # Load map data to memory
+            # Load map data
             mapData = self.window.readMap(map)
             
-            os.chdir(map.directory)
-            
-            # Create relevant directories
-            os.makedirs(f'{map.orig}_Files/Fits', exist_ok = True)
-            os.makedirs(f'{map.orig}_Files/Fits/Reports', exist_ok = True)
-            os.makedirs(f'{map.orig}_Files/Fits/Heatmaps', exist_ok = True)
-            if self.varChkFitFig.get():
-                # Only create this if the user wants the fit figures
-                os.makedirs(f'{map.orig}_Files/Fits/Figures', exist_ok = True)
-                    
-            frequencies = mapData.pop('freq')
-            # dict to save the peak intensities for heatmaps
-            mapIntensities = {}
-            
-            for key, intensity in mapData.items():
-                
-                # Perform minimization
-                minner = Minimizer(self.cost, params, 
-                                   fcn_args = (intensity, frequencies))
-                result = minner.minimize()
-                bestParams = result.params
-                
-                # Write the result to files 
-                self.writeFitSpectra(bestParams, frequencies, intensity, key, map)
-                self.writeFitReport(result, key, map)
-                
-                spectraInts = []
-
-                v = bestParams.valuesdict()
-                # Extract the intensity value for each peak and append it to mapIntensities
-                for peak in range(numPeaks):
-                    spectraInts.append(round(v[f'h{peak}'], 2))
-                
-                mapIntensities[key] = spectraInts
-                
-                # Update progress bar
-                self.window.statFrame.progressBar['value'] += progressStep
-                self.window.statFrame.update_idletasks()
-            
-            # Write the heatmap files for each peak and update progress bar
-            self.writeHeatmaps(mapIntensities, map)
-            self.window.statFrame.progressBar['value'] += progressStep
-            self.window.statFrame.update_idletasks()
-        
-        # Reset progress bar
-        self.window.statFrame.progressBar['value'] = 0
-        self.window.statFrame.progressLabel.config(text = 'Processing: ')
+            fitMapSpectra(params, mapData, map, options, workers, job.progress)
+        return 0
+    
+    def finishFitMap(self, params: Parameters, fix: bool, options: dict, result: int):
+        ''' Updates the Tab once the maps are fitted '''
+        # Record the step to replay it on other maps
+        numPeaks = int((len(params) - 2) / 3)
+        self.window.recipe.add('fit', 
+                               offset = params['offset'].value, 
+                               slope = params['slope'].value, 
+                               bands = [[params[f'{name}{peak}'].value for name in 'xdh'] for peak in range(numPeaks)], 
+                               fix = fix, 
+                               options = options)
         
         # Log process
         self.window.insertLog('fitMap')
@@ -585,200 +532,27 @@ class FitTab(ttk.Frame):
         self.fitBase.allChangesSaved = True
         return 0
             
-    def writeHeatmaps(self, mapIntensities: dict, map: Map):
-        ''' Write the heatmap files from the fit result.
-        A heatmap is a 2D representation of a 3D graph using color as a scale '''
-        numPeaks = self.fitBands.getUsefulLength()
-        
-        os.chdir(f'{map.orig}_Files/Fits/Heatmaps')
-        
-        # Write the file
-        with open(f'{map.name}_heatmaps.txt', 'w') as newFile:
-            newFile.write('X(um)\tY(um)')
-            
-            for peak in range(numPeaks):
-                newFile.write(f'\tI(B{peak})')
-            
-            for key, intensities in mapIntensities.items():
-                newFile.write('\n')
-                newFile.write(f'{key[0]}\t{key[1]}')
-                for peak in range(numPeaks):
-                    newFile.write(f'\t{intensities[peak]}')
-        
-        os.chdir(map.directory)
-        
-        # If the user wants, generate the figure for the saved heatmap
-        if self.varChkSaveHeat.get():
-            self.drawHeatFigure(mapIntensities, map)
-        return 0
-    
-    def drawHeatFigure(self, mapIntensities: dict, map: Map):
-        numPeaks = self.fitBands.getUsefulLength()
-        
-        # Create the x and y points of the map.
-        # They generate the image that was scanned in the map
-        x = np.array([])
-        y = np.array([])
-        for key in mapIntensities:
-            x = np.append(x, key[0])
-            y = np.append(y, key[1])
-        
-        # Eliminate repeats and sort them
-        x = np.sort(np.unique(x))
-        y = np.sort(np.unique(y))
-        
-        os.chdir(f'{map.orig}_Files/Fits/Heatmaps')
-        
-        for peak in range(numPeaks):
-            # Add all the intensities for the given peak
-            intensities = np.array([])
-            for yValue in y:
-                for xValue in x:
-                    intensities = np.append(intensities, mapIntensities[(xValue, yValue)][peak])
-            
-            # Plot the heatmap in greyscale and save it
-            fig, ax = plt.subplots()
-            pc = ax.imshow(intensities.reshape(len(x), len(y)), 
-                           aspect = 'auto', origin = 'lower',
-                           interpolation = 'gaussian', cmap = 'Greys')
-            plt.colorbar(pc)
-            
-            fig.savefig(f'{map.name}_heatmap_band{peak}.png')
-            plt.close(fig)
-        
-        os.chdir(map.directory)
-        return 0
-    
-    @staticmethod
-    def writeFitReport(fitResult, key: tuple, map: Map):
-        # Remove decimal to avoid filename corruption
-        x = key[0].replace('.', '')
-        y = key[1].replace('.', '')
-
-        # Save the number of decimals for the filename
-        if '.' in key[0]:
-            xDec = len(key[0]) - key[0].index('.') - 1
-        else:
-            xDec = 0
-        
-        if '.' in key[1]:
-            yDec = len(key[1]) - key[1].index('.') - 1
-        else:
-            yDec = 0
-        
-        os.chdir(f'{map.orig}_Files/Fits/Reports')
-        
-        # Write the fit report for this (x, y) point
-        with open(f'{map.name}_X_{x}_E-{xDec}_Y_{y}_E-{yDec}.txt', 'w') as newFile:
-            newFile.write(fit_report(fitResult))
+    def loadResults(self):
+        ''' Reads a results file saved by fitMap and generates its heatmap files and figures,
+        without fitting the map again '''
+        filename = askopenfilename(filetypes = [('Fit results', '*_results.npz')])
+        if filename == '':
+            return 1
         
-        os.chdir(map.directory)
-        return 0
+        fitResults = FitResults.load(filename)
         
-    def writeFitSpectra(self, params: Parameters, frequencies: list, intensities: list, key: tuple, map: Map): 
-        numPeaks = self.fitBands.getLength()
-        v = params.valuesdict()
+        # The results file is saved in the {orig}_Files/Fits folder of the map directory
+        directory = os.path.dirname(os.path.dirname(os.path.dirname(filename)))
+        map = Map(directory, fitResults.metadata['name'], fitResults.metadata['orig'], len(fitResults))
         
-        # Get the intensity values for the optimized model
-        fit = calculateModel(params, frequencies)
-
-        os.chdir(f'{map.orig}_Files/Fits')
+        os.makedirs(f'{map.directory}/{map.orig}_Files/Fits/Heatmaps', exist_ok = True)
         
-        # Remove decimal to avoid filename corruption
-        x = key[0].replace('.', '')
-        y = key[1].replace('.', '')
-
-        # Save the number of decimals for the filename
-        if '.' in key[0]:
-            xDec = len(key[0]) - key[0].index('.') - 1
-        else:
-            xDec = 0
+        writeHeatmaps(fitResults.mapIntensities(), map, self.varChkSaveHeat.get())
         
-        if '.' in key[1]:
-            yDec = len(key[1]) - key[1].index('.') - 1
-        else:
-            yDec = 0
-                
-        with open(f'{map.name}_X_{x}_E-{xDec}_Y_{y}_E-{yDec}.txt', 'w') as newFile:
-            newFile.write('Wavenumber(cm-1)\tIntData\tInt(FitTotal)\tInt(Baseline)')
-            
-            bandFit = {}
-            for peak in range(numPeaks):
-                # For each peak add an intensitity column header
-                newFile.write(f'\tInt(B{peak})')
-                
-                # And add the intensity of a fit containing a single band
-                bandParams = Parameters()
-                bandParams.add('offset', value = v['offset'])
-                bandParams.add('slope', value = v['slope'])
-                bandParams.add('x0', value = v['x' + str(peak)])
-                bandParams.add('d0', value = v['d' + str(peak)])
-                bandParams.add('h0', value = v['h' + str(peak)])
-                
-                bandFit[f'B{peak}'] = calculateModel(bandParams, frequencies)
-                
-            newFile.write('\n')
-            
-            # Write the values for frequency, intensity data, fit data, baseline,
-            # and the intensity of each single band
-            for index, freq in enumerate(frequencies):
-                newFile.write(f'{freq:.2f}\t{intensities[index]:.2f}\t{fit[index]:.2f}\t')
-                newFile.write(f'{freq * v["slope"] + v["offset"]:.2f}')
-                              
-                for peak in range(numPeaks):
-                    newFile.write(f'\t{bandFit["B" + str(peak)][index]:.2f}')
-                newFile.write('\n')
-        
-        os.chdir(map.directory)
-        
-        if self.varChkFitFig.get():
-            # If selected by user, generate the fit figures
-            self.drawFitFigure(frequencies, intensities, key, fit, bandFit, params, map)
+        showinfo('Information', 
+                 'Heatmaps generated successfully')
         return 0
     
-    @staticmethod
-    def drawFitFigure(frequencies: list, intensities: list, key: tuple, fit: list, bandFit: dict, params: Parameters, map: Map):
-        ''' Generate figures for spectra fitting. '''
-        fig = plt.Figure()
-        
-        # Add subplot
-        plot1 = fig.add_subplot(111, xlabel = 'Wavenumber (cm-1)', ylabel = 'Intensity')
-        
-        # Plot data and total band fit
-        plot1.plot(frequencies, intensities, 'k')
-        plot1.plot(frequencies, fit, 'r', alpha = 0.8)
-        
-        # Plot each Band element
-        for peak in range(len(bandFit)):
-            plot1.plot(frequencies, bandFit[f'B{peak}'], alpha = 0.5)
-        
-        v = params.valuesdict()
-        # Plot baseline
-        plot1.plot(frequencies, np.array(frequencies) * v['slope'] + v['offset'], alpha = 0.5)
-        
-        # Remove decimal to avoid filename corruption
-        x = key[0].replace('.', '')
-        y = key[1].replace('.', '')
-
-        # Save the number of decimals for the filename
-        if '.' in key[0]:
-            xDec = len(key[0]) - key[0].index('.') - 1
-        else:
-            xDec = 0
-        
-        if '.' in key[1]:
-            yDec = len(key[1]) - key[1].index('.') - 1
-        else:
-            yDec = 0
-        
-        os.chdir(f'{map.orig}_Files/Fits/Figures')
-        
-        fig.savefig(f'{map.name}_X_{x}_E-{xDec}_Y_{y}_E-{yDec}_fit.png')
-        plt.close()
-        
-        os.chdir(map.directory)
-        return 0
-
     def displaySpectra(self, window: Tk = None):
         ''' Display current average spectra with the Tab specific plots. '''
         if window is None:
@@ -789,32 +563,48 @@ class FitTab(ttk.Frame):
         
         window.getAverageSpectra()
         
-        # Reinitialize plot
-        plot = window.plotFrame.figure.reInitPlot()
+        # Start a new display, reusing the plotted lines
+        window.plotFrame.figure.startDisplay()
         
-        # Get the index for the selected Map in Legend Frame
-        for index, average in window.averages.enumerate():
-            if average[0].orig == window.varSelectedMap.get():
-                selectedMapIndex = index
-                break
+        # Plot every average spectra 
+        window.plotAverages()
         
-        for col, spectra in window.averages.enumerate(): 
-            # Plot every average spectra 
-            plot.plot(spectra[1][0], spectra[1][1], 
-                      color = COLORS[col % len(COLORS)])
-            
-            # Only continue plotting Band elements for the currently selected Map
-            if col != selectedMapIndex:
+        # Add the spectra statistics, if chosen by user
+        window.plotStatistics()
+        
+        # Plot the baseline and Band elements for the currently selected Map
+        self.plotFit(window)
+
+        window.plotFrame.figure.rescale()
+        window.plotFrame.figure.saveLimits()
+        window.plotFrame.figure.drawCanvas()
+        
+        # Update limits in Status Frame
+        self.window.statFrame.getLimits()
+        return 0
+    
+    def plotFit(self, window: Tk = None):
+        ''' Sets the baseline, the model and each Band element for the currently selected Map,
+        as an overlay of the plot '''
+        if window is None:
+            window = self.window
+        
+        lines = []
+        for spectra in window.averages:
+            # Only plot Band elements for the currently selected Map
+            if spectra[0].orig != window.varSelectedMap.get():
                 continue
             
+            frequencies = spectra[1][0]
+            
             # Only plot if there are collected Band elements
             offset = self.fitBase.getOffset()
             slope = self.fitBase.getSlope()
             if slope != '' and offset != '':
-                spectraBase = np.array(spectra[1][0]) * float(slope) + float(offset )
-                            
-                plot.plot(spectra[1][0], spectraBase, c = '#444444')
-
+                spectraBase = np.array(frequencies) * float(slope) + float(offset)
+                
+                lines.append((frequencies, spectraBase, {'color': '#444444'}))
+            
             # If there are collected Band elements, ensure that no baseline parameters are undefined
             if self.fitBands.getUsefulLength() != 0:
                 if self.fitBase.getOffset() == '':
@@ -825,21 +615,27 @@ class FitTab(ttk.Frame):
                 fitParams = self.createGuideParams()
                 
                 # Calculate model for current Band elements and plot
-                spectraFit = calculateModel(fitParams, spectra[1][0])
+                spectraFit = calculateModel(fitParams, frequencies)
                 
-                plot.plot(spectra[1][0], spectraFit, c = '#191919')
+                lines.append((frequencies, spectraFit, {'color': '#191919'}))
                 
                 #Plot each individal Band elements
-                for band in self.fitBands.bandDict().values():
+                for peak, band in enumerate(self.fitBands.bandDict().values()):
                     bandParams = self.createGuideParams({'B0': band})
-                    bandFit = calculateModel(bandParams, spectra[1][0])
-                    plot.plot(spectra[1][0], bandFit, alpha = 0.5) 
-
-        window.plotFrame.figure.saveLimits()
-        window.plotFrame.figure.drawCanvas()
+                    bandFit = calculateModel(bandParams, frequencies)
+                    lines.append((frequencies, bandFit, {'color': f'C{peak % 10}', 'alpha': 0.5}))
+            break
         
-        # Update limits in Status Frame
-        self.window.statFrame.getLimits()
+        window.plotFrame.figure.setLines('fit', lines, overlay = True)
+        return 0
+    
+    def displayFit(self):
+        ''' Redraws only the baseline and Band elements '''
+        if self.window.maps.isEmpty():
+            return 1
+        
+        self.plotFit()
+        self.window.plotFrame.figure.updateOverlay()
         return 0
 
     def handleMouseEvent(self, x: float, y: float):
@@ -851,7 +647,7 @@ class FitTab(ttk.Frame):
                 # addReference method returns True if all 3 reference points are gathered and collection is finished
                 self.fitBands.changeCollecting()
                 self.btnSelectBand.config(bg = '#f0f0f0')
-                self.displaySpectra()
+                self.displayFit()
                 
                 # Change Radiobutton selection to next Band element un less this is the last one
                 if self.varSelectedBand.get() != f'B{self.fitBands.getLength() - 1}':
@@ -862,6 +658,6 @@ class FitTab(ttk.Frame):
             # If fit baseline collection is ON, add a reference point to FitBaseline element
             if self.fitBase.addReference(x, y):
                 # addReference method returns True if all 2 reference points were gathered and collection is finished
-                self.displaySpectra()
+                self.displayFit()
                 
         return 0
@@ -0,0 +1,34 @@
+import numpy as np
+
+class FrequencyAxis:
+    ''' Index over the frequency values of a map, built once, for nearest frequency lookups.
+    Lookups are binary searches over the sorted frequencies, so ascending and descending
+    axes are both supported. '''
+    def __init__(self, freq: np.ndarray):
+        self.freq = np.asarray(freq, dtype = float)
+
+        # Sorted distinct frequencies and the position of their first occurrence in the axis
+        self.sorted, self.order = np.unique(self.freq, return_index = True)
+
+    def closest(self, values):
+        ''' Returns the index of the closest frequency to each value, for a single value or an array of values.
+        Ties resolve to the lowest index '''
+        values = np.asarray(values, dtype = float)
+
+        if len(self.sorted) == 1:
+            return np.zeros(values.shape, dtype = int)[()]
+
+        # Neighbouring sorted frequencies on each side of the values
+        right = np.clip(np.searchsorted(self.sorted, values), 1, len(self.sorted) - 1)
+        left = right - 1
+
+        leftDif = np.abs(values - self.sorted[left])
+        rightDif = np.abs(self.sorted[right] - values)
+
+        useLeft = (leftDif < rightDif) | ((leftDif == rightDif) & (self.order[left] < self.order[right]))
+
+        return np.where(useLeft, self.order[left], self.order[right])[()]
+
+    def __len__(self):
+        ''' Number of frequencies in the axis '''
+        return len(self.freq)
@@ -1,59 +1,156 @@
+from __future__ import annotations
 import numpy as np
-from lmfit import Parameters
+from typing import TYPE_CHECKING
+from .FrequencyAxis import FrequencyAxis
+
+# lmfit is slow to import and only needed here for annotations
+if TYPE_CHECKING:
+    from lmfit import Parameters
 
 def isNumber(s):
     ''' Used to validate Entry widgets' input for ints, floats or empty strings'''
     return s.isdigit() or s.replace('.', '0', 1).isdigit() or s == ''
 
-def findClosest(value: float, samples: list):
-    ''' Finds the index of the closest element to value in the list sample. '''
-    minDif = 1e9
-    minIndex = 0
-    for index, sample in enumerate(samples):
-        dif = abs(value - sample)
-        if dif < minDif:
-            minDif = dif
-            minIndex = index
-    return minIndex
+def paramsVector(params: Parameters):
+    '''Flattens params into the parameter vector used by evaluateModel:
+    [offset, slope, x0, d0, h0, x1, d1, h1, ...]'''
+    return np.array([param.value for param in params.values()])
+
+def evaluateModel(x: np.ndarray, p: np.ndarray):
+    '''Sum of Lorentzian peaks on a linear baseline, computed for all peaks at once by broadcasting.
+    - x: frequency array, shape (n_freq,)
+    - p: parameter vector [offset, slope, x0, d0, h0, ...], shape (n_params,).
+    It can also hold a parameter vector per row, shape (n_spectra, n_params), to evaluate many models at once
+    Returns the model y data, shape (n_freq,) or (n_spectra, n_freq)'''
+    p = np.asarray(p)
+    offset, slope = p[..., 0, None], p[..., 1, None]
+    
+    # Peak parameters with a trailing axis to broadcast against x, shape (..., n_peaks, 1)
+    position, decay, height = p[..., 2::3, None], p[..., 3::3, None], p[..., 4::3, None]
+    
+    # Lorentzian with half width g is h * g^2 / ((x - p)^2 + g^2)
+    g2 = (0.5 * decay) ** 2
+    peaks = height * g2 / ((x - position) ** 2 + g2)
+    
+    return offset + slope * x + peaks.sum(axis = -2)
+
+def evaluateJacobian(x: np.ndarray, p: np.ndarray):
+    '''Derivatives of the model created by evaluateModel with respect to each parameter in p.
+    Returns an array with a row for each x value and a column for each parameter, shape (n_freq, n_params).
+    With a parameter vector per row in p, returns one such array per spectrum, shape (n_spectra, n_freq, n_params)'''
+    p = np.asarray(p)
+    position, decay, height = p[..., 2::3, None], p[..., 3::3, None], p[..., 4::3, None]
+    
+    dx = x - position
+    g2 = (0.5 * decay) ** 2
+    denominator = dx ** 2 + g2
+    
+    jacobian = np.empty(p.shape[:-1] + (len(x), p.shape[-1]))
+    jacobian[..., 0] = 1
+    jacobian[..., 1] = x
+    
+    # Peak derivatives have shape (..., n_peaks, n_freq), swapped into the parameter columns
+    jacobian[..., 2::3] = np.swapaxes(2 * height * g2 * dx / denominator ** 2, -1, -2)
+    jacobian[..., 3::3] = np.swapaxes(height * decay * dx ** 2 / (2 * denominator ** 2), -1, -2)
+    jacobian[..., 4::3] = np.swapaxes(g2 / denominator, -1, -2)
+    
+    return jacobian
 
 def calculateModel(params: Parameters, x: list):
     '''Uses params to create the model y data. Corresponds to a sum of Lorentzian peaks on a linear baseline
     - params: Contains Parameter instances to be used for the model
     - x: list of x values to be computed in the creation of the model'''
-    numPeaks = int((len(params) - 2) / 3)
-    
-    # Create an empty array
-    y = np.zeros(len(x))
-    
-    v = params.valuesdict()
-    
-    offset, slope = v['offset'], v['slope']
-    
-    # Add the linear baseline defined by slope and offset
-    y += offset
-    for i in range(len(x)):
-        y[i] += slope * x[i]
-        
-    x = np.array(x)
-    # For each peak, adds a lorentzian function with the corresponding parameters
-    for i in range(numPeaks):
-        p, d, h = v[f'x{i}'], v[f'd{i}'], v[f'h{i}']
-        y += (h * ((0.5 * d) ** 2)) * (1 / (((x - p) ** 2) + ((0.5 * d) ** 2)))    
-    
-    return y
-
-def averageBox(values: list, index: int, box: int):
-    '''Values is a list of floats and the value of interest is at index. 
-    Averages values in the index intervals (index-box, index + box) excluding out of bounds '''
-    # Check if the interval is fully included in the values list, if not, defines limit indexes
-    if index - box < 0:
-        minIndex = None
-        maxIndex = index + box + 1
-    elif index + box >= len(values) - 1:
-        minIndex = index - box
-        maxIndex = None
+    return evaluateModel(np.asarray(x, dtype = float), paramsVector(params))
+
+def anchorBoxes(axis: FrequencyAxis, anchors: list, box: int):
+    '''Start and stop indexes of the box of values averaged around each anchor, from box values before it to box values after it.
+    The box is centered at the frequency of axis closest to the anchor and clipped to the frequency range'''
+    indexes = axis.closest(np.asarray(anchors, dtype = float).reshape(-1))
+    
+    return np.maximum(indexes - box, 0), np.minimum(indexes + box + 1, len(axis))
+
+def interpolationWeights(x: np.ndarray, xp: list):
+    '''Matrix of linear interpolation weights, shape (len(x), len(xp)), such that
+    weights @ fp is equal to np.interp(x, xp, fp) for any fp'''
+    return np.column_stack([np.interp(x, xp, column) for column in np.eye(len(xp))])
+
+def calculateBaselines(spectra: np.ndarray, boxes: tuple, weights: np.ndarray):
+    '''Baselines of many spectra at once, shape (n_spectra, n_freq).
+    The anchor intensities are the averages of each box in boxes, computed for all spectra
+    from the cumulative sums of the intensities, and the baselines are interpolated with weights.
+    - spectra: intensities, shape (n_spectra, n_freq)
+    - boxes: start and stop indexes of each anchor box, as returned by anchorBoxes
+    - weights: interpolation matrix, as returned by interpolationWeights
+    Returns the anchor intensities, shape (n_spectra, n_anchors), and the baselines'''
+    start, stop = boxes
+    
+    # Cumulative sums with a leading zero, so the sum of a box is the difference of two columns
+    cumulative = np.zeros((len(spectra), spectra.shape[1] + 1))
+    np.cumsum(spectra, axis = 1, out = cumulative[:, 1:])
+    
+    yAnchors = (cumulative[:, stop] - cumulative[:, start]) / (stop - start)
+    
+    return yAnchors, yAnchors @ weights.T
+
+def coordinateName(key: tuple):
+    '''Filename part for the (x, y) key of a spectrum, as X_{x}_E-{xDec}_Y_{y}_E-{yDec}.
+    Decimal points are removed to avoid filename corruption, and the number of decimals is kept instead'''
+    names = []
+    for axis, value in zip('XY', key):
+        decimals = len(value) - value.index('.') - 1 if '.' in value else 0
+        names.append(f'{axis}_{value.replace(".", "")}_E-{decimals}')
+    return '_'.join(names)
+
+def decimateMinMax(x: np.ndarray, y: np.ndarray, xmin: float, xmax: float, bins: int):
+    '''Indexes of the points of a line to draw between xmin and xmax, at most about 2 * bins of them.
+    The visible points are split in bins of consecutive points and only the minimum and maximum
+    of each bin are kept, so peaks are never lost. The points next to the limits are kept so the line
+    reaches the plot edges. x must be sorted, in ascending or descending order'''
+    n = len(x)
+    if x[0] > x[-1]:
+        # Search the reversed axis and convert back to the original indexes
+        start = n - np.searchsorted(x[::-1], xmax, 'right')
+        stop = n - np.searchsorted(x[::-1], xmin, 'left')
     else:
-        minIndex = index - box
-        maxIndex = index + box + 1
+        start = np.searchsorted(x, xmin, 'left')
+        stop = np.searchsorted(x, xmax, 'right')
+    
+    start = max(start - 1, 0)
+    stop = min(stop + 1, n)
+    if stop - start <= 2 * bins:
+        return np.arange(start, stop)
+    
+    # Bins of equal size, and the remaining points as a last smaller bin
+    size = -(-(stop - start) // bins)
+    full = (stop - start) // size * size
+    blocks = y[start: start + full].reshape(-1, size)
+    offsets = start + np.arange(0, full, size)
+    
+    indexes = [offsets + np.argmin(blocks, axis = 1), offsets + np.argmax(blocks, axis = 1), [start, stop - 1]]
+    if start + full < stop:
+        rest = y[start + full: stop]
+        indexes.append([start + full + np.argmin(rest), start + full + np.argmax(rest)])
+    
+    return np.unique(np.concatenate(indexes))
 
-    return sum(values[minIndex: maxIndex]) / len(values[minIndex: maxIndex])
\ No newline at end of file
+def gridIndex(coords: np.ndarray):
+    '''Places each (x, y) coordinate in the map grid, whose columns are the sorted x values
+    and rows the sorted y values. Returns the (row, column) position of each coordinate, shape (n_spectra, 2),
+    and the x values of the columns and y values of the rows'''
+    coords = np.asarray(coords).astype(float).reshape(-1, 2)
+    xValues, columns = np.unique(coords[:, 0], return_inverse = True)
+    yValues, rows = np.unique(coords[:, 1], return_inverse = True)
+    
+    return np.column_stack((rows, columns)), xValues, yValues
+
+def gridImages(positions: np.ndarray, shape: tuple, values: np.ndarray):
+    '''Images of the map with one layer for each column of values, shape (n_rows, n_columns, n_values).
+    - positions: (row, column) position of each spectrum, as returned by gridIndex
+    - shape: number of rows and columns of the grid
+    - values: values of each spectrum, shape (n_spectra, n_values)
+    Grid points without a spectrum are NaN'''
+    values = np.asarray(values, dtype = float).reshape(len(positions), -1)
+    
+    images = np.full((*shape, values.shape[1]), np.nan)
+    images[positions[:, 0], positions[:, 1]] = values
+    return images
@@ -0,0 +1,178 @@
+import queue
+import threading
+from tkinter import Tk
+from tkinter.messagebox import showinfo, showerror
+from .Progress import Progress, ProgressTracker
+
+# Time in ms between checks for the messages posted by a running job
+POLL_INTERVAL = 100
+
+class JobCancelled(Exception):
+    ''' Raised inside a running job when the user cancels it '''
+
+class Job:
+    ''' Handle given to the work function of a job. It only posts messages for the main thread,
+    so the work function never needs to touch Tk widgets.
+    Progress is counted in spectra, out of total, and posted at most a few times per second '''
+    def __init__(self, messages: queue.Queue, total: int = 0):
+        self.messages = messages
+        self.cancelRequest = threading.Event()
+        self.tracker = ProgressTracker(total, self.post)
+
+    def progress(self, count: int = 1):
+        ''' Adds count processed spectra. Raises JobCancelled if the job was cancelled,
+        so work functions stop at their next progress update '''
+        self.checkCancelled()
+        self.tracker.advance(count)
+        return 0
+
+    def setTotal(self, total: int):
+        ''' Sets the number of spectra the job processes, for jobs that only know it once they started '''
+        self.tracker.total = total
+        return 0
+
+    def post(self, progress: Progress):
+        ''' Sends the progress to the main thread '''
+        self.messages.put(('progress', progress))
+        return 0
+
+    def checkCancelled(self):
+        ''' Raises JobCancelled if the job was cancelled '''
+        if self.cancelRequest.is_set():
+            raise JobCancelled()
+        return 0
+
+    def cancel(self):
+        ''' Asks the job to stop '''
+        self.cancelRequest.set()
+        return 0
+
+class JobRunner:
+    ''' Runs the long operations of the program in a worker thread, one at a time, so the Tk main loop
+    stays responsive. The job posts its progress to a queue, which the main thread polls with after() '''
+    def __init__(self, window: Tk):
+        self.window = window
+        self.messages = queue.Queue()
+        self.job = None
+        self.done = None
+        self.stopped = None
+        self.then = None
+        self.label = ''
+
+    def isBusy(self):
+        ''' Checks if a job is running '''
+        return self.job is not None
+
+    def run(self, label: str, work, done = None, total: int = 0, stopped = None):
+        ''' Runs work(job) in a worker thread, showing label next to the progress bar.
+        total is the number of spectra the job processes, for the progress bar and the time left.
+        When it finishes, done(result) is called in the main thread with the value returned by work.
+        If it is cancelled or fails, stopped() is called in the main thread instead.
+        Only one job can run at a time, and the window disables the processing widgets while it runs '''
+        if self.isBusy():
+            showerror('Error',
+                      'Another process is running')
+            return 1
+
+        self.job = Job(self.messages, total)
+        self.done = done
+        self.stopped = stopped
+        self.label = label
+        self.window.setBusy(True)
+
+        self.window.statFrame.progressLabel.config(text = f'Processing:   {label}')
+        self.window.statFrame.btnCancel.config(state = 'normal')
+
+        threading.Thread(target = self.execute, args = (self.job, work), daemon = True).start()
+        self.window.after(POLL_INTERVAL, self.poll)
+        return 0
+
+    def execute(self, job: Job, work):
+        ''' Runs in the worker thread. Posts the outcome of the job as the last message '''
+        try:
+            self.messages.put(('done', work(job)))
+        except JobCancelled:
+            self.messages.put(('cancelled', None))
+        except Exception as error:
+            self.messages.put(('error', error))
+        return 0
+
+    def poll(self):
+        ''' Applies the messages posted by the job. Runs in the main thread '''
+        progress = None
+        while True:
+            try:
+                kind, value = self.messages.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == 'progress':
+                # Only the latest progress needs to be shown
+                progress = value
+            else:
+                return self.finish(kind, value)
+
+        if progress is not None:
+            self.showProgress(progress)
+
+        self.window.after(POLL_INTERVAL, self.poll)
+        return 0
+
+    def showProgress(self, progress: Progress):
+        ''' Updates the progress bar and label. Runs in the main thread '''
+        self.window.statFrame.progressBar['value'] = progress.fraction() * self.window.statFrame.progressBar['maximum']
+        self.window.statFrame.progressLabel.config(text = f'Processing:   {self.label} ({progress.describe()})')
+        return 0
+
+    def finish(self, kind: str, value):
+        ''' Resets the progress bar and reports the outcome of the job. Runs in the main thread '''
+        done, stopped, then = self.done, self.stopped, self.then
+        self.job = None
+        self.done = None
+        self.stopped = None
+        self.then = None
+        self.window.setBusy(False)
+
+        # Reset progress bar
+        self.window.statFrame.progressBar['value'] = 0
+        self.window.statFrame.progressLabel.config(text = 'Processing: ')
+        self.window.statFrame.btnCancel.config(state = 'disabled')
+
+        if kind == 'done':
+            if done is not None:
+                done(value)
+        elif stopped is not None:
+            stopped()
+
+        # The job was cancelled to run something else, such as closing the program
+        if then is not None:
+            then()
+            return 0
+
+        if kind == 'done':
+            return 0
+
+        # Maps processed before the job stopped are already saved, so show their current state
+        self.window.legFrame.updateLegend()
+        self.window.chooseDisplay()
+
+        if kind == 'cancelled':
+            showinfo('Information',
+                     'The process was cancelled')
+        else:
+            showerror('Error',
+                      f'The process failed: {value}')
+        return 0
+
+    def cancel(self, then = None):
+        ''' Cancels the running job, if any. The job stops at its next progress update.
+        then() is called in the main thread once the job stopped, instead of reporting the cancellation,
+        or right away if there is no job '''
+        if self.job is None:
+            if then is not None:
+                then()
+            return 0
+
+        self.then = then
+        self.job.cancel()
+        return 0
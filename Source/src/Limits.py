@@ -1,4 +1,4 @@
-from matplotlib.pyplot import Axes
+from matplotlib.axes import Axes
 
 class Limits:
     ''' Class containing the current Limits of the plot in Plot Frame'''
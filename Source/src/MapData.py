@@ -0,0 +1,237 @@
+import json
+import numpy as np
+from .FrequencyAxis import FrequencyAxis
+from .Global_Functions import gridIndex
+
+# Maximum size in bytes of the blocks of spectra processed at once
+BLOCK_SIZE = 2 ** 26
+
+# Parsing a block of map file lines holds about this many copies of their text at once:
+# the lines, their intensity fields and the joined fields parsed by NumPy, plus the parsed values
+PARSE_COPIES = 4
+
+# Maximum number of spectra sampled to estimate percentiles
+SAMPLE_SIZE = 2000
+
+class MapData:
+    ''' Contains the data of a map as contiguous arrays.
+    - freq: frequency values, shape (n_freq,)
+    - coords: (x, y) coordinates as written in the map file, shape (n_spectra, 2)
+    - spectra: intensity values for each (x, y) point, shape (n_spectra, n_freq).
+    It can be a memory-mapped array, in which case spectraFile is the .npy file backing it
+    - axis: FrequencyAxis index of the frequencies, for nearest frequency lookups '''
+    def __init__(self, freq: np.ndarray, coords: np.ndarray, spectra: np.ndarray, spectraFile: str = None):
+        self.freq = freq
+        self.axis = FrequencyAxis(freq)
+        self.coords = coords
+        self.spectra = spectra
+        self.spectraFile = spectraFile
+
+    @staticmethod
+    def parseLines(text: str, nFreq: int, dtype: type = np.float64):
+        ''' Parses the spectra lines of a map file, each with the y and x coordinates followed by
+        the intensities at each frequency. Returns the (x, y) coordinates and the intensities '''
+        # Only the coordinates are split off as strings, the intensities are parsed by NumPy directly
+        fields = [line.split(maxsplit = 2) for line in text.splitlines() if line.strip()]
+
+        # File columns are y, x. Stored as (x, y) to match the map keys
+        coords = np.array([(x, y) for y, x, values in fields], dtype = str).reshape(-1, 2)
+        spectra = np.fromstring(' '.join([values for y, x, values in fields]), dtype = dtype, sep = ' ')
+
+        return coords, spectra.reshape(len(fields), nFreq)
+
+    @staticmethod
+    def readHeader(filename: str, dtype: type = np.float64):
+        ''' Reads the frequencies of a map file and counts its spectra, without parsing them.
+        Returns the frequencies and the number of spectra '''
+        with open(filename, 'r') as file:
+            freq = np.array(file.readline().split(), dtype = dtype)
+            nSpectra = sum(1 for line in file if line.strip())
+
+        return freq, nSpectra
+
+    @classmethod
+    def readBlocks(cls, filename: str, dtype: type = np.float64, blockSize: int = BLOCK_SIZE):
+        ''' Parses the spectra of a LabSpec6 map export in blocks of lines, so that the map never
+        needs to fit in memory. Blocks are sized by their text, so parsing one uses about blockSize bytes.
+        Yields the (x, y) coordinates and the intensities of each block '''
+        with open(filename, 'r') as file:
+            nFreq = len(file.readline().split())
+
+            while True:
+                # Whole lines of about blockSize / PARSE_COPIES characters
+                text = ''.join(file.readlines(max(1, blockSize // PARSE_COPIES)))
+                if not text.strip():
+                    break
+                yield cls.parseLines(text, nFreq, dtype)
+
+    @classmethod
+    def convertFile(cls, filename: str, path: str, dtype: type = np.float64, blockSize: int = BLOCK_SIZE):
+        ''' Parses a LabSpec6 map export in blocks of lines into a memory-mapped working copy,
+        so that the map never needs to fit in memory. path is the working copy filename without extension '''
+        freq, nSpectra = cls.readHeader(filename, dtype)
+
+        mapData = cls.create(path, freq, np.empty((nSpectra, 2), dtype = str), dtype)
+        allCoords = []
+
+        start = 0
+        for coords, spectra in cls.readBlocks(filename, dtype, blockSize):
+            mapData.spectra[start: start + len(spectra)] = spectra
+            allCoords.append(coords)
+            start += len(spectra)
+
+        mapData.coords = np.concatenate(allCoords)
+        return mapData
+
+    @classmethod
+    def create(cls, path: str, freq: np.ndarray, coords: np.ndarray, dtype: type = np.float64):
+        ''' Returns a MapData with an empty memory-mapped spectra array backed by path.npy,
+        to be filled block by block. path is the filename without extension '''
+        spectra = np.lib.format.open_memmap(f'{path}.npy', mode = 'w+', dtype = dtype,
+                                            shape = (len(coords), len(freq)))
+
+        return cls(freq, coords, spectra, f'{path}.npy')
+
+    @classmethod
+    def fromBinary(cls, path: str):
+        ''' Loads a working copy written by toBinary. path is the filename without extension.
+        The spectra are memory-mapped and only read from disk when accessed. '''
+        with open(f'{path}.json', 'r') as file:
+            metadata = json.load(file)
+
+        freq = np.array(metadata['freq'])
+        coords = np.array(metadata['coords'], dtype = str).reshape(-1, 2)
+        spectra = np.load(f'{path}.npy', mmap_mode = 'r')
+
+        return cls(freq, coords, spectra, f'{path}.npy')
+
+    def toBinary(self, path: str, metadata: dict = None):
+        ''' Writes the map data as a binary working copy. path is the filename without extension.
+        The spectra are stored as a .npy file and the frequencies, coordinates and
+        any extra metadata in a .json sidecar '''
+        if self.spectraFile == f'{path}.npy':
+            # Already backed by the working copy file
+            self.spectra.flush()
+        else:
+            np.save(f'{path}.npy', self.spectra)
+
+        if metadata is None:
+            metadata = {}
+
+        with open(f'{path}.json', 'w') as file:
+            json.dump({**metadata,
+                       'freq': self.freq.tolist(),
+                       'coords': self.coords.tolist()}, file)
+        return 0
+
+    def toFile(self, filename: str):
+        ''' Writes the map data exactly as the input file formats '''
+        with open(filename, 'w') as file:
+            self.writeHeader(file)
+
+            for block in self.blocks():
+                self.writeSpectra(file, block)
+        return 0
+
+    def writeHeader(self, file):
+        ''' Writes the frequencies line of the map file format to an open file '''
+        freqFormat = '\t'.join(['%.3f'] * len(self.freq))
+        file.write('\t\t' + freqFormat % tuple(self.freq) + '\t\n')
+        return 0
+
+    def writeSpectra(self, file, block: slice = slice(None)):
+        ''' Writes the lines of the spectra in block, in the map file format, to an open file '''
+        lineFormat = '%s\t%s\t' + '\t'.join(['%.2f'] * len(self.freq)) + '\t\n'
+
+        for (x, y), intensities in zip(self.coords[block], self.spectra[block]):
+            file.write(lineFormat % (y, x, *intensities))
+        return 0
+
+    def blocks(self, blockSize: int = BLOCK_SIZE):
+        ''' Yields slices of consecutive spectra of at most blockSize bytes '''
+        rows = max(1, blockSize // max(1, self.spectra.shape[1] * self.spectra.itemsize))
+
+        for start in range(0, len(self), rows):
+            yield slice(start, min(start + rows, len(self)))
+
+    def mean(self):
+        ''' Returns the average spectrum, accumulated block by block '''
+        total = np.zeros(len(self.freq))
+
+        for block in self.blocks():
+            total += self.spectra[block].sum(axis = 0)
+
+        return total / len(self)
+
+    def statistics(self, percentiles: tuple = (5, 25, 50, 75, 95), blockSize: int = BLOCK_SIZE):
+        ''' Computes the mean, standard deviation, minimum, maximum and percentiles at each frequency
+        in a single pass over the spectra, one block at a time.
+        Mean and variance of each block are merged into the running values.
+        Percentiles are computed from a uniform random sample of the spectra of the whole map
+        (reservoir sampling, Algorithm R). The sample holds at most SAMPLE_SIZE spectra, and no more
+        than fit in blockSize bytes, so percentiles are exact for maps up to that many spectra. '''
+        nFreq = len(self.freq)
+        
+        count = 0
+        mean = np.zeros(nFreq)
+        sqDev = np.zeros(nFreq)
+        minimum = np.full(nFreq, np.inf)
+        maximum = np.full(nFreq, -np.inf)
+        
+        # The sample never exceeds a block in size
+        sampleSize = min(SAMPLE_SIZE, len(self), max(1, blockSize // (nFreq * 8)))
+        sample = np.empty((sampleSize, nFreq))
+        rng = np.random.default_rng(0)
+        
+        for block in self.blocks(blockSize):
+            data = np.asarray(self.spectra[block], dtype = np.float64)
+            
+            # Merge the block mean and squared deviations with the running ones
+            blockMean = data.mean(axis = 0)
+            delta = blockMean - mean
+            total = count + len(data)
+            
+            mean += delta * len(data) / total
+            sqDev += ((data - blockMean) ** 2).sum(axis = 0) + delta ** 2 * count * len(data) / total
+            count = total
+            
+            np.minimum(minimum, data.min(axis = 0), out = minimum)
+            np.maximum(maximum, data.max(axis = 0), out = maximum)
+            
+            # Fill the sample with the first spectra. Spectrum i of the map then replaces a random slot
+            # with probability sampleSize / (i + 1), drawing j uniformly from 0 to i and replacing slot j if j < sampleSize
+            indexes = np.arange(block.start, block.stop)
+            fill = indexes < sampleSize
+            sample[indexes[fill]] = data[fill]
+            
+            slots = rng.integers(0, indexes + 1)
+            replace = np.flatnonzero(~fill & (slots < sampleSize))
+            
+            # When a slot is replaced more than once in the block, the last spectrum is kept, as in the sequential algorithm
+            last = len(replace) - 1 - np.unique(slots[replace][::-1], return_index = True)[1]
+            sample[slots[replace[last]]] = data[replace[last]]
+        
+        return {'mean': mean,
+                'std': np.sqrt(sqDev / count),
+                'min': minimum,
+                'max': maximum,
+                'percentiles': dict(zip(percentiles, np.percentile(sample, percentiles, axis = 0)))}
+
+    def gridIndex(self):
+        ''' Places each spectrum in the map grid. Returns the (row, column) position of each spectrum,
+        shape (n_spectra, 2), and the sorted x values of the columns and y values of the rows '''
+        return gridIndex(self.coords)
+
+    def keys(self):
+        ''' Returns the (x, y) coordinates as a list of tuples of strings '''
+        return [(x, y) for x, y in self.coords]
+
+    def items(self):
+        ''' For iteration over (x, y) keys and intensities, reading one block at a time '''
+        for block in self.blocks():
+            keys = [(x, y) for x, y in self.coords[block]]
+            yield from zip(keys, np.asarray(self.spectra[block]))
+
+    def __len__(self):
+        ''' Number of spectra in the map '''
+        return len(self.spectra)
@@ -0,0 +1,102 @@
+import os
+import numpy as np
+from .MapData import MapData
+from .Progress import doNothing
+
+# Number of lines indexed between progress updates
+PROGRESS_LINES = 1000
+
+class MapIndex:
+    ''' Byte offset and (x, y) coordinates of every spectrum line of a map file,
+    to read any spectrum or subset of spectra without parsing the whole file.
+    - filename: the indexed map file
+    - freq: frequency values, from the first line of the file
+    - offsets: byte offset of each spectrum line, shape (n_spectra,)
+    - coords: (x, y) coordinates as written in the map file, shape (n_spectra, 2) '''
+    def __init__(self, filename: str, freq: np.ndarray, offsets: np.ndarray, coords: np.ndarray):
+        self.filename = filename
+        self.freq = freq
+        self.offsets = offsets
+        self.coords = coords
+
+        # Spectrum index by (x, y) key, built when first needed
+        self.positions = None
+
+    @classmethod
+    def build(cls, filename: str, progress = doNothing):
+        ''' Indexes a map file in one pass over its lines, without parsing the intensities '''
+        offsets = []
+        coords = []
+
+        with open(filename, 'rb') as file:
+            header = file.readline()
+            freq = np.array(header.split(), dtype = float)
+
+            offset = len(header)
+            for line in file:
+                fields = line.split(maxsplit = 2)
+                if fields:
+                    # File columns are y, x. Stored as (x, y) to match the map keys
+                    offsets.append(offset)
+                    coords.append((fields[1].decode(), fields[0].decode()))
+
+                    if len(offsets) % PROGRESS_LINES == 0:
+                        progress(PROGRESS_LINES)
+                offset += len(line)
+
+        progress(len(offsets) % PROGRESS_LINES)
+        return cls(filename, freq, np.array(offsets, dtype = np.int64), np.array(coords, dtype = str).reshape(-1, 2))
+
+    @classmethod
+    def cached(cls, filename: str, path: str, progress = doNothing):
+        ''' Returns the index of a map file saved as path_index.npz, building and saving it
+        if it does not exist or the map file changed since it was built '''
+        try:
+            return cls.load(filename, path)
+        except (OSError, ValueError, KeyError):
+            index = cls.build(filename, progress)
+            index.save(path)
+            return index
+
+    @classmethod
+    def load(cls, filename: str, path: str):
+        ''' Reads an index saved by save. Raises ValueError if the map file changed since it was built '''
+        with np.load(f'{path}_index.npz') as arrays:
+            status = os.stat(filename)
+            if arrays['source'].tolist() != [status.st_size, status.st_mtime_ns]:
+                raise ValueError('The map file changed since it was indexed')
+
+            return cls(filename, arrays['freq'], arrays['offsets'], arrays['coords'])
+
+    def save(self, path: str):
+        ''' Writes the index as path_index.npz, with the size and modification time of the map file '''
+        status = os.stat(self.filename)
+        np.savez(f'{path}_index.npz',
+                 source = np.array([status.st_size, status.st_mtime_ns], dtype = np.int64),
+                 freq = self.freq,
+                 offsets = self.offsets,
+                 coords = self.coords)
+        return 0
+
+    def find(self, key: tuple):
+        ''' Returns the index of the spectrum at the (x, y) key, None if there is none '''
+        if self.positions is None:
+            self.positions = {(x, y): index for index, (x, y) in enumerate(self.coords)}
+        return self.positions.get(key)
+
+    def read(self, indexes, dtype: type = np.float64):
+        ''' Reads the spectra at indexes, a single index or a list of them, seeking each line.
+        Returns their (x, y) coordinates and intensities, shape (n_spectra, n_freq) '''
+        indexes = np.atleast_1d(indexes)
+
+        with open(self.filename, 'rb') as file:
+            lines = []
+            for index in indexes:
+                file.seek(self.offsets[index])
+                lines.append(file.readline().decode())
+
+        return MapData.parseLines(''.join(lines), len(self.freq), dtype)
+
+    def __len__(self):
+        ''' Number of spectra in the map file '''
+        return len(self.offsets)
@@ -47,8 +47,10 @@ class Maps:
 class Map:
     ''' Dataclass to store the map directory and name.
     orig and name start out the same, but name evolves with processing.
-    spectraNum is set afterwards with the number of spectra in the map'''
+    spectraNum is set afterwards with the number of spectra in the map.
+    revision counts the processed versions of the map saved in the temp folder'''
     directory: str
     name: str
     orig: str
     spectraNum: int = None
+    revision: int = 0
@@ -0,0 +1,404 @@
+from __future__ import annotations
+import os
+import re
+import numpy as np
+from contextlib import nullcontext
+from typing import TYPE_CHECKING
+from .Maps import Map
+from .Progress import doNothing
+from .MapData import MapData
+from .FitResults import FitResults
+from .FitEngine import fitSpectra
+from .SpectraWriter import SpectraWriter
+from .FigureExport import FigureExporter
+from .Global_Functions import (anchorBoxes, interpolationWeights, calculateBaselines, calculateModel, coordinateName,
+                               gridIndex, gridImages)
+
+# lmfit and matplotlib are slow to import, so they are imported by the functions that use them.
+# This keeps the module free of any GUI import and fast to load in scripts and worker processes
+if TYPE_CHECKING:
+    from lmfit import Parameters
+
+# Number of points averaged around each anchor for its baseline intensity
+ANCHOR_BOX = 3
+
+def shiftSpectra(mapData: MapData, shiftedData: MapData, shiftY: float, progress = doNothing):
+    ''' Fills shiftedData with the spectra of mapData shifted by shiftY in intensity, one block at a time.
+    The frequency shift is applied when shiftedData is created '''
+    for block in mapData.blocks():
+        shiftedData.spectra[block] = mapData.spectra[block] + shiftY
+        progress(block.stop - block.start)
+    return 0
+
+def cutSpectra(mapData: MapData, cutData: MapData, startIndex: int, endIndex: int, progress = doNothing):
+    ''' Fills cutData with the spectra of mapData between the startIndex and endIndex frequencies, one block at a time '''
+    for block in mapData.blocks():
+        cutData.spectra[block] = mapData.spectra[block, startIndex: endIndex]
+        progress(block.stop - block.start)
+    return 0
+
+def subtractSpectra(mapData: MapData, subData: MapData, anchors: list, map: Map,
+                    saveFigures: bool = False, progress = doNothing):
+    ''' Fills subData with the spectra of mapData minus the baseline interpolated between the anchors.
+    Writes the individual subtracted spectra of the map, and their figures if saveFigures '''
+    frequencies = mapData.freq
+
+    # Anchor boxes and interpolation weights are shared by all spectra in the map
+    boxes = anchorBoxes(mapData.axis, anchors, ANCHOR_BOX)
+    weights = interpolationWeights(frequencies, anchors)
+
+    # Figures are saved in parallel while the next blocks are subtracted
+    with SpectraWriter(f'{map.directory}/{map.orig}_Files/Individual Spectra/Subtracted', frequencies) as writer, \
+         FigureExporter() if saveFigures else nullcontext() as exporter:
+        for block in mapData.blocks():
+            intensities = np.asarray(mapData.spectra[block])
+
+            # Baselines of the whole block, interpolated between the anchor points
+            yAnchors, yBase = calculateBaselines(intensities, boxes, weights)
+
+            # Subtract the intensity data to interpolated data
+            subtracted = intensities - yBase
+            subData.spectra[block] = subtracted
+
+            # Save individual spectra ( and figures, if chosen by user)
+            keys = [(x, y) for x, y in mapData.coords[block]]
+            writer.write([f'{map.orig}_{coordinateName(key)}_subtracted.txt' for key in keys], subtracted)
+
+            if saveFigures:
+                for index, key in enumerate(keys):
+                    drawBaselineFigures(key, map, frequencies, intensities[index], anchors, yAnchors[index], yBase[index],
+                                        exporter)
+
+            progress(block.stop - block.start)
+    return 0
+
+def drawBaselineFigures(key: tuple, map: Map, frequencies: list, intensities: list, anchors: list,
+                        yAnchors: np.ndarray, yBase: np.ndarray, exporter: FigureExporter):
+    ''' Saves the figures of a spectrum with its baseline, and of the subtracted spectrum, with exporter '''
+    path = f'{map.directory}/{map.orig}_Files/Figures/Subtracted'
+    os.makedirs(path, exist_ok = True)
+
+    # Plot data, the baseline as a line and the anchor points
+    exporter.add('baseline', f'{path}/{map.orig}_{coordinateName(key)}_baseline.png',
+                 frequencies, intensities, anchors, yAnchors)
+
+    # Plot the subtracted data
+    exporter.add('spectrum', f'{path}/{map.orig}_{coordinateName(key)}_subtracted.png',
+                 frequencies, intensities - yBase)
+    return 0
+
+def saveBaselineParameters(map: Map, anchors: list):
+    ''' Save the baseline parameters used for future reference '''
+    os.makedirs(f'{map.directory}/{map.orig}_Files/Parameters', exist_ok = True)
+
+    with open(f'{map.directory}/{map.orig}_Files/Parameters/BaselineParameters.txt', 'w') as newFile:
+        newFile.write('Linear interpolation between anchor points.\n')
+        newFile.write(f'Intensity value for each anchor is an average intensity of box = {ANCHOR_BOX}.\n\n')
+        newFile.write('Anchor points (cm-1):')
+
+        for anchor in anchors:
+            newFile.write(f' {anchor:.2f}')
+    return 0
+
+def readBaselineParameters(filename: str):
+    ''' Reads the anchors from a file written by saveBaselineParameters.
+    Raises ValueError if the file is not a baseline file '''
+    with open(filename, 'r') as file:
+        lines = file.readlines()
+
+    # Check for correct content - can fail for an unfortunate selection
+    if not lines or 'Linear interpolation' not in lines[0]:
+        raise ValueError('File must be the result of a baseline subtraction')
+
+    # Use only anchors line
+    anchors = []
+    for line in lines[2:]:
+        anchors += [float(anchor) for anchor in line.split()[3:]]
+    return anchors
+
+def readGuideFitParameters(filename: str):
+    ''' Reads the parameters of a guide fit report, saved as GuideFitParams.txt.
+    Returns the baseline offset and slope, and a (position, decay, intensity) tuple for each band,
+    rounded as shown in the Fit tab. Raises ValueError if the file is not a guide fit report '''
+    with open(filename, 'r') as file:
+        text = file.read()
+
+    # The parameters are listed in the Variables section of the report
+    section = re.search(r'\[\[Variables\]\]\n(.*?)(?:\n\[\[|$)', text, re.DOTALL)
+    if section is None:
+        raise ValueError('File must be the result of a guide fit')
+
+    values = {}
+    for line in section.group(1).splitlines():
+        match = re.match(r'\s*(offset|slope|[xdh]\d+):\s+(\S+)', line)
+        if match:
+            values[match.group(1)] = round(float(match.group(2)), 2)
+
+    numPeaks = len([name for name in values if name.startswith('h')])
+    if 'offset' not in values or 'slope' not in values or numPeaks == 0:
+        raise ValueError('No parameters to import or incorrect number of parameters to import')
+
+    try:
+        bands = [(values[f'x{peak}'], values[f'd{peak}'], values[f'h{peak}']) for peak in range(numPeaks)]
+    except KeyError:
+        raise ValueError('No parameters to import or incorrect number of parameters to import')
+
+    return values['offset'], values['slope'], bands
+
+def mapParameters(offset: float, slope: float, bands: list, fix: bool = False):
+    ''' Creates the initial parameters of the map fit, from the baseline offset and slope and
+    a (position, decay, intensity) tuple for each band. With fix, positions and decays are not varied.
+    If not, they are allowed a +- 3 variation to accomodate inhomogeneity '''
+    from lmfit import Parameters
+
+    params = Parameters()
+
+    # Add linear baseline parameters
+    params.add('offset', value = float(offset))
+    params.add('slope', value = float(slope))
+
+    for bandNum, (position, decay, intensity) in enumerate(bands):
+        if fix:
+            params.add(f'x{bandNum}',
+                       value = float(position),
+                       vary = False)
+            params.add(f'd{bandNum}',
+                       value = float(decay),
+                       vary = False)
+        else:
+            params.add(f'x{bandNum}',
+                       value = float(position),
+                       min = float(position) - 3,
+                       max = float(position) + 3)
+            params.add(f'd{bandNum}',
+                       value = float(decay),
+                       min = float(decay) - 3,
+                       max = float(decay) + 3)
+        params.add(f'h{bandNum}',
+                   value = float(intensity),
+                   min = 0)
+    return params
+
+def fitMapSpectra(params: Parameters, mapData: MapData, map: Map, options: dict,
+                  workers: int = 1, progress = doNothing):
+    ''' Fits every spectrum of the map and writes the results.
+    options holds the choices of the Fit tab, as described in MapFit '''
+    with MapFit(params, map, options, workers) as mapFit:
+        mapFit.fit(mapData, progress)
+        mapFit.finish(progress)
+    return 0
+
+class MapFit:
+    ''' Fits the spectra of a map and writes the results. The spectra can be given all at once
+    or in consecutive blocks, each as a MapData, with the map files written by finish.
+    options holds the choices of the Fit tab, by name:
+    - store: save every result in a single results file, instead of a report and a fit file for each spectrum
+    - figures: save the fit figure of each spectrum
+    - heatFigures: save the heatmap figures
+    - warm: start each fit from the result of its neighbours. With blocks, only neighbours in the same block are used
+    To be used as a context manager, which waits for the fit figures to be saved '''
+    def __init__(self, params: Parameters, map: Map, options: dict, workers: int = 1):
+        self.params = params
+        self.map = map
+        self.options = options
+        self.workers = workers
+        self.numPeaks = int((len(params) - 2) / 3)
+
+        # dict to save the peak intensities for heatmaps
+        self.mapIntensities = {}
+
+        # Results of each block, to be saved in a single file
+        self.fitResults = []
+
+        # Create relevant directories
+        fitsPath = f'{map.directory}/{map.orig}_Files/Fits'
+        os.makedirs(f'{fitsPath}/Heatmaps', exist_ok = True)
+        if not options['store']:
+            # Reports are only written as files without the single results file
+            os.makedirs(f'{fitsPath}/Reports', exist_ok = True)
+        if options['figures']:
+            # Only create this if the user wants the fit figures
+            os.makedirs(f'{fitsPath}/Figures', exist_ok = True)
+
+        # Fit figures are saved in parallel while the next spectra are fitted
+        self.exporter = FigureExporter() if options['figures'] else None
+
+    def fit(self, mapData: MapData, progress = doNothing):
+        ''' Fits the spectra of mapData and writes the files of each spectrum '''
+        frequencies = mapData.freq
+        fitResults = FitResults(frequencies, mapData.coords, list(self.params))
+
+        # Grid positions of the spectra, to start each fit from its neighbours
+        grid = mapData.gridIndex()[0] if self.options['warm'] else None
+
+        # Fit the spectra in parallel, results are returned in map order
+        results = fitSpectra(self.params, frequencies, mapData.spectra, self.workers, grid)
+
+        for index, ((key, intensity), result) in enumerate(zip(mapData.items(), results)):
+            bestParams = result.params
+
+            # Write the result to files, or keep it for the single results file
+            if self.options['store']:
+                fitResults.add(index, result)
+                if self.options['figures']:
+                    fit = calculateModel(bestParams, frequencies)
+                    bandFit = calculateBandFits(bestParams, frequencies)
+                    drawFitFigure(frequencies, intensity, key, fit, bandFit, bestParams, self.map, self.exporter)
+            else:
+                writeFitSpectra(bestParams, frequencies, intensity, key, self.map, self.exporter)
+                writeFitReport(result, key, self.map)
+
+            spectraInts = []
+
+            v = bestParams.valuesdict()
+            # Extract the intensity value for each peak and append it to mapIntensities
+            for peak in range(self.numPeaks):
+                spectraInts.append(round(v[f'h{peak}'], 2))
+
+            self.mapIntensities[key] = spectraInts
+
+            progress(1)
+
+        if self.options['store']:
+            self.fitResults.append(fitResults)
+        return 0
+
+    def finish(self, progress = doNothing):
+        ''' Writes the results file and the heatmaps of the whole map '''
+        if self.options['store']:
+            fitResults = FitResults.concatenate(self.fitResults)
+            fitResults.save(f'{self.map.directory}/{self.map.orig}_Files/Fits/{self.map.name}_results.npz',
+                            {'name': self.map.name, 'orig': self.map.orig})
+
+        # Write the heatmap files for each peak
+        progress(0)
+        writeHeatmaps(self.mapIntensities, self.map, self.options['heatFigures'])
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        if self.exporter is not None:
+            self.exporter.__exit__(*exception)
+        return False
+
+def writeFitReport(fitResult, key: tuple, map: Map):
+    ''' Write the fit report for this (x, y) point '''
+    from lmfit import fit_report
+
+    with open(f'{map.directory}/{map.orig}_Files/Fits/Reports/{map.name}_{coordinateName(key)}.txt', 'w') as newFile:
+        newFile.write(fit_report(fitResult))
+    return 0
+
+def writeFitSpectra(params: Parameters, frequencies: list, intensities: list, key: tuple, map: Map,
+                    exporter: FigureExporter = None):
+    ''' Write the data, the fit, the baseline and each band of a spectrum fit as columns.
+    The fit figure is saved with exporter, if given '''
+    numPeaks = int((len(params) - 2) / 3)
+    v = params.valuesdict()
+
+    # Get the intensity values for the optimized model
+    fit = calculateModel(params, frequencies)
+
+    with open(f'{map.directory}/{map.orig}_Files/Fits/{map.name}_{coordinateName(key)}.txt', 'w') as newFile:
+        newFile.write('Wavenumber(cm-1)\tIntData\tInt(FitTotal)\tInt(Baseline)')
+
+        # Add an intensity column header for each peak
+        for peak in range(numPeaks):
+            newFile.write(f'\tInt(B{peak})')
+
+        newFile.write('\n')
+
+        # And the intensity of a fit containing a single band
+        bandFit = calculateBandFits(params, frequencies)
+
+        # Write the values for frequency, intensity data, fit data, baseline,
+        # and the intensity of each single band
+        for index, freq in enumerate(frequencies):
+            newFile.write(f'{freq:.2f}\t{intensities[index]:.2f}\t{fit[index]:.2f}\t')
+            newFile.write(f'{freq * v["slope"] + v["offset"]:.2f}')
+
+            for peak in range(numPeaks):
+                newFile.write(f'\t{bandFit["B" + str(peak)][index]:.2f}')
+            newFile.write('\n')
+
+    if exporter is not None:
+        # If selected by user, generate the fit figures
+        drawFitFigure(frequencies, intensities, key, fit, bandFit, params, map, exporter)
+    return 0
+
+def calculateBandFits(params: Parameters, frequencies: list):
+    ''' Returns the model of each band alone over the linear baseline, by band name '''
+    from lmfit import Parameters
+
+    v = params.valuesdict()
+
+    bandFit = {}
+    for peak in range(int((len(params) - 2) / 3)):
+        bandParams = Parameters()
+        bandParams.add('offset', value = v['offset'])
+        bandParams.add('slope', value = v['slope'])
+        bandParams.add('x0', value = v['x' + str(peak)])
+        bandParams.add('d0', value = v['d' + str(peak)])
+        bandParams.add('h0', value = v['h' + str(peak)])
+
+        bandFit[f'B{peak}'] = calculateModel(bandParams, frequencies)
+    return bandFit
+
+def drawFitFigure(frequencies: list, intensities: list, key: tuple, fit: list, bandFit: dict, params: Parameters, map: Map,
+                  exporter: FigureExporter):
+    ''' Generate figures for spectra fitting, saved with exporter '''
+    v = params.valuesdict()
+
+    # Plot data, total band fit, each Band element and the baseline
+    exporter.add('fit', f'{map.directory}/{map.orig}_Files/Fits/Figures/{map.name}_{coordinateName(key)}_fit.png',
+                 frequencies, intensities, fit,
+                 [bandFit[f'B{peak}'] for peak in range(len(bandFit))],
+                 np.array(frequencies) * v['slope'] + v['offset'])
+    return 0
+
+def writeHeatmaps(mapIntensities: dict, map: Map, saveFigures: bool = False):
+    ''' Write the heatmap files from the fit result, and their figures if saveFigures.
+    A heatmap is a 2D representation of a 3D graph using color as a scale '''
+    numPeaks = len(next(iter(mapIntensities.values())))
+
+    # Write the file
+    with open(f'{map.directory}/{map.orig}_Files/Fits/Heatmaps/{map.name}_heatmaps.txt', 'w') as newFile:
+        newFile.write('X(um)\tY(um)')
+
+        for peak in range(numPeaks):
+            newFile.write(f'\tI(B{peak})')
+
+        for key, intensities in mapIntensities.items():
+            newFile.write('\n')
+            newFile.write(f'{key[0]}\t{key[1]}')
+            for peak in range(numPeaks):
+                newFile.write(f'\t{intensities[peak]}')
+
+    # If the user wants, generate the figure for the saved heatmap
+    if saveFigures:
+        drawHeatFigure(mapIntensities, map)
+    return 0
+
+def drawHeatFigure(mapIntensities: dict, map: Map):
+    ''' Save a greyscale heatmap figure for each band '''
+    from matplotlib.figure import Figure
+
+    # Place the (x, y) points in the grid of the image that was scanned in the map
+    positions, x, y = gridIndex(list(mapIntensities))
+
+    # Images of every band at once, rows are y values and columns x values. Missing points are NaN
+    images = gridImages(positions, (len(y), len(x)), list(mapIntensities.values()))
+
+    for peak in range(images.shape[2]):
+        # Plot the heatmap in greyscale and save it, without the missing points
+        fig = Figure()
+        ax = fig.add_subplot(111)
+        pc = ax.imshow(np.ma.masked_invalid(images[:, :, peak]),
+                       aspect = 'auto', origin = 'lower',
+                       interpolation = 'gaussian', cmap = 'Greys')
+        fig.colorbar(pc)
+
+        fig.savefig(f'{map.directory}/{map.orig}_Files/Fits/Heatmaps/{map.name}_heatmap_band{peak}.png')
+    return 0
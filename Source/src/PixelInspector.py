@@ -0,0 +1,115 @@
+import numpy as np
+from .Maps import Map
+from .MapData import MapData
+from .MapIndex import MapIndex
+from .Progress import doNothing
+from settings import IMAGES
+from tkinter import Tk, Toplevel
+from .Global_Functions import gridImages
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
+
+def pixelTotals(mapData: MapData, progress = doNothing):
+    ''' Total intensity of each spectrum, read one block at a time. 
+    It reads the whole map, so it runs in the background before the inspector is opened '''
+    totals = []
+    for block in mapData.blocks():
+        totals.append(np.asarray(mapData.spectra[block]).sum(axis = 1))
+        
+        # Update progress bar
+        progress(block.stop - block.start)
+    return np.concatenate(totals)
+
+class PixelInspector(Toplevel):
+    ''' Window with the map as an image of the total intensity of each pixel.
+    Clicking a pixel shows its current spectrum, from the latest working copy in the temp folder, 
+    and its original spectrum, read from the map file through the MapIndex without parsing the whole file.
+    totals is the total intensity of each spectrum of the working copy, as returned by pixelTotals '''
+    def __init__(self, window: Tk, map: Map, index: MapIndex, totals: np.ndarray):
+        super().__init__(window)
+        self.window = window
+        self.map = map
+        self.index = index
+        self.title(f'Inspect pixels - {map.name}')
+        self.iconbitmap(rf'{IMAGES}/main.ico')
+        
+        # Working copy of the spectra, replaced by the next revision once a job commits it
+        self.mapData = window.readMap(map)
+        self.revision = map.revision
+        
+        # Grid position of each spectrum, and the spectrum at each grid position (-1 if none)
+        self.positions, x, y = self.mapData.gridIndex()
+        self.pixels = np.full((len(y), len(x)), -1)
+        self.pixels[self.positions[:, 0], self.positions[:, 1]] = np.arange(len(self.positions))
+        
+        self.configureLayout(gridImages(self.positions, self.pixels.shape, totals)[:, :, 0])
+    
+    def configureLayout(self, image: np.ndarray):
+        ''' Configures the image and spectra plots '''
+        self.figure = Figure(figsize = (10, 4.5), dpi = 96)
+        self.figure.subplots_adjust(wspace = 0.3)
+        
+        self.imagePlot = self.figure.add_subplot(121, xlabel = 'Column', ylabel = 'Row')
+        self.imagePlot.imshow(np.ma.masked_invalid(image), 
+                              aspect = 'auto', origin = 'lower', cmap = 'Greys')
+        
+        self.spectraPlot = self.figure.add_subplot(122, 
+                                                   xlabel = 'Wavenumber (cm-1)', 
+                                                   ylabel = 'Raman Intensity')
+        
+        # Lines of the selected pixel, updated on every click
+        self.marker, = self.imagePlot.plot([], [], 's', c = 'red', fillstyle = 'none', markersize = 10)
+        self.original, = self.spectraPlot.plot([], [], c = 'grey', label = 'Original')
+        self.current, = self.spectraPlot.plot([], [], c = 'k', label = 'Current')
+        self.spectraPlot.legend(loc = 'upper right')
+        
+        self.canvas = FigureCanvasTkAgg(self.figure, master = self)
+        self.toolbar = NavigationToolbar2Tk(self.canvas, self)
+        self.toolbar.update()
+        self.canvas.get_tk_widget().pack(fill = 'both', expand = True)
+        
+        # Connect mouse input in the image to select pixels
+        self.canvas.mpl_connect('button_press_event', self.selectPixel)
+        self.canvas.draw()
+        return 0
+    
+    def selectPixel(self, event):
+        ''' Shows the spectra of the clicked pixel, if it has any '''
+        if event.inaxes is not self.imagePlot or event.xdata is None:
+            return 1
+        
+        row = int(round(event.ydata))
+        column = int(round(event.xdata))
+        if not (0 <= row < self.pixels.shape[0] and 0 <= column < self.pixels.shape[1]) or self.pixels[row, column] < 0:
+            return 1
+        
+        return self.showSpectrum(self.pixels[row, column])
+    
+    def showSpectrum(self, spectrum: int):
+        ''' Plots the current and original spectra of the spectrum at the given index of the working copy '''
+        # Processing keeps the spectra order, so only the working copy needs to be read again.
+        # Maps removed from the program keep showing the last working copy read
+        if self.map.revision != self.revision and self.map in self.window.maps:
+            self.mapData = self.window.readMap(self.map)
+            self.revision = self.map.revision
+        
+        key = tuple(self.mapData.coords[spectrum])
+        
+        # Current spectrum, from the memory-mapped working copy
+        self.current.set_data(self.mapData.freq, self.mapData.spectra[spectrum])
+        
+        # Original spectrum, seeking its line in the map file
+        original = self.index.find(key)
+        if original is None:
+            self.original.set_data([], [])
+        else:
+            self.original.set_data(self.index.freq, self.index.read(original)[1][0])
+        
+        row, column = self.positions[spectrum]
+        self.marker.set_data([column], [row])
+        self.spectraPlot.set_title(f'X = {key[0]}   Y = {key[1]}')
+        
+        self.spectraPlot.relim()
+        self.spectraPlot.autoscale_view()
+        self.canvas.draw_idle()
+        return 0
@@ -1,10 +1,17 @@
+import numpy as np
 from .Limits import Limits
+from .Global_Functions import decimateMinMax
 from tkinter import Tk, Frame
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
 
-class PltFigure(plt.Figure):
-    ''' Contains the methods for the matplotlib plot and its update functions '''
+class PltFigure(Figure):
+    ''' Contains the methods for the matplotlib plot and its update functions.
+    The plotted lines are kept in named groups and reused between displays, only updating their data.
+    Overlay groups, such as anchors or cut limits, are drawn over a saved copy of the rest of the plot,
+    so changing them only redraws the overlay lines.
+    Long lines only draw the minimum and maximum of the points under each pixel of the visible x range,
+    recomputed whenever the x limits change '''
     def __init__(self, frame: Frame, window: Tk):
         self.frame = frame
         self.window = window
@@ -17,10 +24,14 @@ class PltFigure(plt.Figure):
         self.canvas = FigureCanvasTkAgg(self, master = frame)
         self.toolbar = NavigationToolbar2Tk(self.canvas, frame)
         self.toolbar.update()
+        self.canvas.get_tk_widget().pack()
 
         # Connect mouse input in plot to collect data
         self.canvas.mpl_connect('button_press_event', window.mouseEvent)
         
+        # Save the plot without the overlay after every full draw
+        self.canvas.mpl_connect('draw_event', self.onDraw)
+        
         self.initPlot()
     
     def initPlot(self, data: list = None):
@@ -29,6 +40,19 @@ class PltFigure(plt.Figure):
                                       xlabel = 'Wavenumber (cm-1)', 
                                       ylabel = 'Raman Intensity')
         
+        # Lines and filled areas by group name, the overlay group names,
+        # and the groups set since the display started
+        self.groups = {}
+        self.overlays = set()
+        self.displayed = set()
+        self.background = None
+        
+        # Full data of the lines drawn decimated
+        self.fullData = {}
+        
+        # Decimate again for the new range on every zoom, from the toolbar or changeXZoom
+        self.plot1.callbacks.connect('xlim_changed', self.decimateLines)
+        
         # Set arbitrary limits
         self.axes[0].set_xlim(xmin = 0, xmax = 100)
         self.axes[0].set_ylim(ymin = 0, ymax = 100)
@@ -49,28 +73,139 @@ class PltFigure(plt.Figure):
         return self.plotBounds, self.plotLimits
     
     def drawCanvas(self):
-        ''' Draw the plot canvas '''
+        ''' Draw the plot canvas. Groups not set since startDisplay are removed first '''
+        for name in list(self.groups):
+            if name not in self.displayed:
+                self.removeGroup(name)
+        
         self.canvas.draw()
-        self.canvas.get_tk_widget().pack()
         return 0
     
-    def reInitPlot(self):
-        ''' Reinitialize plot and return it'''
-        self.clear()
-        self.plot1 = self.add_subplot(111,
-                                      xlabel = 'Wavenumber (cm-1)', 
-                                      ylabel = 'Raman Intensity')
-
+    def startDisplay(self):
+        ''' Starts a new display of the plot, which keeps the lines of the groups set again before drawCanvas
+        and removes the rest. Returns the subplot '''
+        self.displayed = set()
         return self.plot1
     
+    def setLines(self, name: str, lines: list, overlay: bool = False):
+        ''' Sets the lines of the group called name. lines has an (x, y, style) tuple for each line,
+        with style a dict of Line2D properties. The lines of the group are updated with set_data
+        and only created or removed when the number of lines changes.
+        Overlay groups are only drawn by onDraw and updateOverlay '''
+        current = self.groups.get(name, [])
+        if len(current) != len(lines) or overlay != (name in self.overlays):
+            self.removeGroup(name)
+            current = [self.plot1.plot([], [])[0] for line in lines]
+        
+        for line, (x, y, style) in zip(current, lines):
+            line.set(animated = overlay, **style)
+            self.setLineData(line, x, y)
+        
+        self.groups[name] = current
+        if overlay:
+            self.overlays.add(name)
+        self.displayed.add(name)
+        return 0
+    
+    def setFills(self, name: str, fills: list):
+        ''' Sets the filled areas of the group called name. fills has an (x, y1, y2, style) tuple for each area,
+        with style a dict of fill_between arguments. Filled areas are always created again '''
+        self.removeGroup(name)
+        self.groups[name] = [self.plot1.fill_between(x, y1, y2, **style) for x, y1, y2, style in fills]
+        self.displayed.add(name)
+        return 0
+    
+    def removeGroup(self, name: str):
+        ''' Removes the lines or filled areas of a group from the plot '''
+        for artist in self.groups.pop(name, []):
+            artist.remove()
+            self.fullData.pop(artist, None)
+        self.overlays.discard(name)
+        return 0
+    
+    def setLineData(self, line, x: list, y: list):
+        ''' Sets the data of a line. Lines without markers and with sorted x values are drawn decimated '''
+        x = np.asarray(x, dtype = float)
+        y = np.asarray(y, dtype = float)
+        
+        steps = np.diff(x)
+        if line.get_marker() in ('None', None, '', ' ') and len(x) > 2 and (np.all(steps >= 0) or np.all(steps <= 0)):
+            self.fullData[line] = (x, y)
+            self.decimateLine(line)
+        else:
+            self.fullData.pop(line, None)
+            line.set_data(x, y)
+        return 0
+    
+    def decimateLine(self, line, xmin: float = None, xmax: float = None):
+        ''' Draws the points of a line between xmin and xmax, the visible range if not given,
+        keeping the minimum and maximum under each pixel '''
+        x, y = self.fullData[line]
+        if xmin is None:
+            xmin, xmax = sorted(self.plot1.get_xlim())
+        
+        index = decimateMinMax(x, y, xmin, xmax, max(1, int(self.plot1.bbox.width)))
+        line.set_data(x[index], y[index])
+        return 0
+    
+    def decimateLines(self, axes = None):
+        ''' Decimates every long line for the visible range '''
+        for line in self.fullData:
+            self.decimateLine(line)
+        return 0
+    
+    def rescale(self):
+        ''' Autoscales both axes to the current data of every group '''
+        self.updateDataLimits()
+        self.plot1.autoscale()
+        return 0
+    
+    def updateDataLimits(self):
+        ''' Recomputes the data limits, which are not updated when lines change their data.
+        Long lines are decimated over their whole range first, so the limits include all their points '''
+        for line in self.fullData:
+            self.decimateLine(line, -np.inf, np.inf)
+        
+        self.plot1.relim()
+        for collection in self.plot1.collections:
+            self.plot1.update_datalim(collection.get_datalim(self.plot1.transData).get_points())
+        
+        self.decimateLines()
+        return 0
+    
+    def onDraw(self, event = None):
+        ''' Called after every full draw of the canvas. Saves the plot without the overlay and draws the overlay on it '''
+        self.background = self.canvas.copy_from_bbox(self.bbox)
+        self.drawOverlay()
+        return 0
+    
+    def drawOverlay(self):
+        ''' Draws the lines of the overlay groups '''
+        for name in self.overlays:
+            for line in self.groups[name]:
+                self.plot1.draw_artist(line)
+        return 0
+    
+    def updateOverlay(self):
+        ''' Redraws only the overlay lines over the saved plot, after the overlay groups were set '''
+        if self.background is None:
+            self.canvas.draw_idle()
+            return 1
+        
+        self.canvas.restore_region(self.background)
+        self.drawOverlay()
+        self.canvas.blit(self.bbox)
+        return 0
+    
     def changeXZoom(self, xmin: float = None, xmax: float = None):
         ''' Change zoom for x axis. If no limits are given, it autoscales it'''
         if (xmin, xmax) == (None, None):
+            self.updateDataLimits()
             self.axes[0].autoscale(axis = 'x')
             return 0
         
         self.axes[0].set_xlim(xmin, xmax)
-
+        
         # Save new limits
         self.saveLimits()
         return 0
@@ -78,6 +213,7 @@ class PltFigure(plt.Figure):
     def changeYZoom(self, ymin: float = None, ymax: float = None):
         ''' Change zoom for y axis. If no limits are given, it autoscales it'''
         if (ymin, ymax) == (None, None):
+            self.updateDataLimits()
             self.axes[0].autoscale(axis = 'y')
             return 0
         
@@ -0,0 +1,83 @@
+import time
+from dataclasses import dataclass
+
+# Minimum time in seconds between two progress reports
+REPORT_INTERVAL = 0.25
+
+def doNothing(count: int = 0):
+    ''' Default progress callback '''
+    return 0
+
+@dataclass
+class Progress:
+    ''' State of a running process, as given to the progress callback.
+    done and total are counted in spectra, elapsed is in seconds '''
+    done: int
+    total: int
+    elapsed: float
+
+    def fraction(self):
+        ''' Processed fraction, between 0 and 1 '''
+        if self.total <= 0:
+            return 0.0
+        return min(1.0, self.done / self.total)
+
+    def rate(self):
+        ''' Average throughput in spectra per second '''
+        if self.elapsed <= 0:
+            return 0.0
+        return self.done / self.elapsed
+
+    def eta(self):
+        ''' Estimated time left in seconds, None while it can not be estimated '''
+        rate = self.rate()
+        if rate <= 0:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+    def describe(self):
+        ''' Short text with the throughput and the time left '''
+        eta = self.eta()
+        if eta is None:
+            return f'{self.done}/{self.total} spectra'
+
+        minutes, seconds = divmod(int(round(eta)), 60)
+        return f'{self.done}/{self.total} spectra, {self.rate():.0f} spectra/s, {minutes:02d}:{seconds:02d} left'
+
+class ProgressTracker:
+    ''' Counts the spectra processed by a long process and calls callback(Progress) at most once
+    every interval seconds, or every step fraction of the total if step is given, and once more at the end.
+    Processing functions only call advance, so they do not depend on how progress is shown '''
+    def __init__(self, total: int, callback, interval: float = REPORT_INTERVAL, step: float = None):
+        self.total = total
+        self.callback = callback
+        self.interval = interval
+        self.step = step
+
+        self.done = 0
+        self.start = time.perf_counter()
+        self.lastTime = self.start
+        self.lastDone = 0
+
+    def advance(self, count: int = 1):
+        ''' Adds count processed spectra, reporting if it is time to '''
+        self.done += count
+        now = time.perf_counter()
+
+        if self.step is not None and self.total > 0:
+            due = (self.done - self.lastDone) >= self.step * self.total
+        else:
+            due = (now - self.lastTime) >= self.interval
+
+        # The end is reported once
+        if due or (self.done >= self.total and self.lastDone < self.total):
+            self.report(now)
+        return 0
+
+    def report(self, now: float = None):
+        ''' Calls the callback with the current progress '''
+        now = time.perf_counter() if now is None else now
+        self.lastTime = now
+        self.lastDone = self.done
+        self.callback(Progress(self.done, self.total, now - self.start))
+        return 0
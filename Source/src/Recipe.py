@@ -0,0 +1,184 @@
+import os
+import json
+import numpy as np
+from contextlib import ExitStack
+from .Maps import Map
+from .MapData import MapData
+from .FrequencyAxis import FrequencyAxis
+from .SpectraWriter import SpectraWriter
+from .Progress import doNothing
+from .FigureExport import FigureExporter
+from .Global_Functions import anchorBoxes, interpolationWeights, calculateBaselines, coordinateName
+from .Pipeline import ANCHOR_BOX, MapFit, mapParameters, drawBaselineFigures, saveBaselineParameters
+
+class Recipe:
+    ''' Processing steps applied to the maps of a session, in order, so they can be replayed over other maps.
+    Each step is a dict with its name and parameters:
+    - shift: x and y, the frequency and intensity shifts
+    - cut: start and end, the frequency limits
+    - subtract: anchors, the baseline anchor frequencies, and figures, to save the baseline figures
+    - fit: offset, slope and bands, a (position, decay, intensity) list for each band,
+      fix, to fix the band positions and decays, and options, the fit options as described in MapFit '''
+    # Suffix added once to the map name by the steps that write a new map
+    SUFFIXES = {'shift': '_shifted', 'cut': '_cut', 'subtract': '_subtracted'}
+
+    def __init__(self, steps: list = None):
+        self.steps = [] if steps is None else steps
+
+    def add(self, name: str, **parameters):
+        ''' Adds a step at the end of the recipe '''
+        self.steps.append({'name': name, **parameters})
+        return 0
+
+    def clear(self):
+        ''' Removes every step '''
+        self.steps = []
+        return 0
+
+    def isEmpty(self):
+        ''' Checks if there are no steps '''
+        return not self.steps
+
+    def save(self, filename: str):
+        ''' Writes the recipe as a json file '''
+        with open(filename, 'w') as file:
+            json.dump({'steps': self.steps}, file, indent = 4)
+        return 0
+
+    @classmethod
+    def load(cls, filename: str):
+        ''' Reads a recipe written by save. Raises ValueError if the file is not a recipe '''
+        with open(filename, 'r') as file:
+            try:
+                steps = json.load(file)['steps']
+            except (ValueError, KeyError, TypeError):
+                raise ValueError('File must be a processing recipe')
+
+        for step in steps:
+            if step.get('name') not in ('shift', 'cut', 'subtract', 'fit'):
+                raise ValueError(f'Unknown processing step: {step.get("name")}')
+        return cls(steps)
+
+    def outputName(self, orig: str):
+        ''' Name of the final map written by apply for the map called orig '''
+        name = orig
+        for step in self.steps:
+            suffix = self.SUFFIXES.get(step['name'])
+            if suffix is not None and suffix not in name:
+                name += suffix
+        return name
+
+    def workload(self, spectraNum: int):
+        ''' Number of progress counts of apply for a map with spectraNum spectra.
+        Each spectrum is counted once for every fit, or once if there are no fits '''
+        fits = sum(step['name'] == 'fit' for step in self.steps)
+        return spectraNum * max(1, fits)
+
+    def apply(self, filename: str, workers: int = 1, progress = doNothing):
+        ''' Replays the recipe over a map file in a single streaming pass. Each block of spectra read
+        from the file goes through every step before the next block is read, so intermediate maps
+        are never written, and only the final map is saved next to the input.
+        Individual spectra, figures, parameters and fit results are written as in the step by step processing.
+        workers is the number of processes fitting the spectra. Returns the final map name '''
+        directory, orig = os.path.split(os.path.abspath(filename)[:-4])
+        freq, spectraNum = MapData.readHeader(filename)
+        name = orig
+
+        # Everything a step needs that does not depend on the spectra is set up once per map
+        stages = []
+        with ExitStack() as stack:
+            for step in self.steps:
+                if step['name'] == 'shift':
+                    freq = freq + step['x']
+                    stage = {}
+
+                elif step['name'] == 'cut':
+                    axis = FrequencyAxis(freq)
+                    stage = {'start': int(axis.closest(step['start'])),
+                             'end': int(axis.closest(step['end'])) + 1}
+                    freq = freq[stage['start']: stage['end']]
+
+                elif step['name'] == 'subtract':
+                    map = Map(directory, name, orig, spectraNum)
+                    saveBaselineParameters(map, step['anchors'])
+
+                    stage = {'map': map,
+                             'freq': freq,
+                             'boxes': anchorBoxes(FrequencyAxis(freq), step['anchors'], ANCHOR_BOX),
+                             'weights': interpolationWeights(freq, step['anchors']),
+                             'writer': stack.enter_context(
+                                 SpectraWriter(f'{directory}/{orig}_Files/Individual Spectra/Subtracted', freq)),
+                             'exporter': stack.enter_context(FigureExporter()) if step['figures'] else None}
+
+                else:
+                    params = mapParameters(step['offset'], step['slope'], step['bands'], step['fix'])
+                    stage = {'freq': freq,
+                             'fit': stack.enter_context(
+                                 MapFit(params, Map(directory, name, orig, spectraNum), step['options'], workers))}
+
+                if step['name'] in self.SUFFIXES and self.SUFFIXES[step['name']] not in name:
+                    name += self.SUFFIXES[step['name']]
+                stages.append((step, stage))
+
+            # Only the final map is written, and only if a step changed the spectra
+            output = None
+            if name != orig:
+                output = stack.enter_context(open(f'{directory}/{name}.txt', 'w'))
+                MapData(freq, np.empty((0, 2), dtype = str), np.empty((0, len(freq)))).writeHeader(output)
+
+            fits = any(step['name'] == 'fit' for step in self.steps)
+            for coords, spectra in MapData.readBlocks(filename):
+                for step, stage in stages:
+                    spectra = self.applyStep(step, stage, coords, spectra, progress)
+
+                if output is not None:
+                    MapData(freq, coords, spectra).writeSpectra(output)
+
+                # Without fits, each spectrum is counted once it went through every step
+                if not fits:
+                    progress(len(spectra))
+
+            for step, stage in stages:
+                if step['name'] == 'fit':
+                    stage['fit'].finish(progress)
+        return name
+
+    @staticmethod
+    def applyStep(step: dict, stage: dict, coords: np.ndarray, spectra: np.ndarray, progress = doNothing):
+        ''' Applies a step to a block of spectra. Returns the spectra after the step '''
+        if step['name'] == 'shift':
+            return spectra + step['y']
+
+        if step['name'] == 'cut':
+            return spectra[:, stage['start']: stage['end']]
+
+        if step['name'] == 'subtract':
+            map = stage['map']
+            yAnchors, yBase = calculateBaselines(spectra, stage['boxes'], stage['weights'])
+
+            # Subtract the intensity data to interpolated data
+            subtracted = spectra - yBase
+
+            # Save individual spectra ( and figures, if chosen by user)
+            keys = [(x, y) for x, y in coords]
+            stage['writer'].write([f'{map.orig}_{coordinateName(key)}_subtracted.txt' for key in keys], subtracted)
+
+            if step['figures']:
+                for index, key in enumerate(keys):
+                    drawBaselineFigures(key, map, stage['freq'], spectra[index], step['anchors'],
+                                        yAnchors[index], yBase[index], stage['exporter'])
+            return subtracted
+
+        # Fits do not change the spectra
+        stage['fit'].fit(MapData(stage['freq'], coords, spectra), progress)
+        return spectra
+
+def findMaps(folder: str, recipe: Recipe = None):
+    ''' Returns the map .txt files in folder. With a recipe, the maps it wrote when replayed
+    over other maps of the folder are left out, so the folder can be processed again '''
+    names = sorted(name[:-4] for name in os.listdir(folder) if name.endswith('.txt'))
+
+    outputs = set()
+    if recipe is not None:
+        outputs = {recipe.outputName(name) for name in names if recipe.outputName(name) != name}
+    return [os.path.join(folder, f'{name}.txt') for name in names if name not in outputs]
@@ -1,7 +1,7 @@
-import os
-import numpy as np
+from .JobRunner import Job
+from functools import partial
+from .Pipeline import shiftSpectra
 from .Global_Functions import isNumber
-from settings import TEMP_PATH, COLORS
 from tkinter.ttk import Frame, Notebook
 from tkinter.messagebox import showinfo, askyesno
 from tkinter import Tk, StringVar, BooleanVar, Label, Entry, Button
@@ -112,7 +112,7 @@ class ShiftTab(Frame):
         self.reference[0].set(f'{x:.2f}')
         self.reference[1].set(f'{y:.2f}')
         self.selectXY()
-        self.displaySpectra()
+        self.displayPoint()
         return 0
     
     def applyShift(self):
@@ -132,36 +132,44 @@ class ShiftTab(Frame):
         self.actual[1].set(self.reference[1].get())
         
         # For potentially long processes, the progress bar in the Status Frame is used
-        progressStep = 300 / (self.window.maps.length() * self.window.maps[0].spectraNum)
-        self.window.statFrame.progressLabel.config(text = 'Processing:   Saving shifted maps')
-        
+        total = self.window.maps.length() * self.window.maps[0].spectraNum
+        
+        # The maps are shifted in the background. The maps saved before a cancellation are kept
+        saved = []
+        self.window.jobs.run('Saving shifted maps', 
+                             partial(self.shiftMaps, shiftX, shiftY, saved), 
+                             partial(self.finishShift, shiftX, shiftY, saved), 
+                             total, 
+                             partial(self.window.commitMaps, saved))
+        return 0
+    
+    def shiftMaps(self, shiftX: float, shiftY: float, saved: list, job: Job):
+        ''' Saves the shifted Map elements, adding a (Map, name) tuple to saved for each one.
+        Runs in the background, so it does not use any widget or change the Map elements '''
         for map in self.window.maps:
-            os.chdir(map.directory)
-            
-            #Get the map data as a dict
+            # Get the map data
             mapData = self.window.readMap(map)
             
-            # Add a suffix to filename to denote the change, but only once
-            if '_shifted' not in map.name:
-                map.name += '_shifted'
+            # Shift the frequencies and the spectra, one block at a time
+            shiftedData = self.window.createMap(map, mapData.freq + shiftX, mapData.coords)
             
-            shiftedData = {}
-            for key, intensities in mapData.items():                
-                if key == 'freq':
-                    shiftedData[key] = list(np.array(intensities) + shiftX)
-                else:
-                    shiftedData[key] = list(np.array(intensities) + shiftY)       
-                
-                #Update progress bar
-                self.window.statFrame.progressBar['value'] += progressStep
-                self.window.statFrame.update_idletasks()
+            shiftSpectra(mapData, shiftedData, shiftY, job.progress)
+            
+            # Add a suffix to filename to denote the change, but only once
+            name = map.name if '_shifted' in map.name else map.name + '_shifted'
             
             # Write the resulting map to temp folder and corresponding directory
-            self.window.writeMap(map, shiftedData)
+            self.window.writeMap(map, shiftedData, name)
+            saved.append((map, name))
+        return 0
+    
+    def finishShift(self, shiftX: float, shiftY: float, saved: list, result: int):
+        ''' Updates the Tab once the shifted maps are saved '''
+        # Use the shifted maps as the current ones
+        self.window.commitMaps(saved)
         
-        # Reset progress bar
-        self.window.statFrame.progressBar['value'] = 0
-        self.window.statFrame.progressLabel.config(text = 'Processing: ')
+        # Record the step to replay it on other maps
+        self.window.recipe.add('shift', x = shiftX, y = shiftY)
         
         # Update legend in Legend Frame
         self.window.legFrame.updateLegend()
@@ -176,7 +184,6 @@ class ShiftTab(Frame):
         self.window.insertLog('shift')
         
         showinfo(title = 'Save',  message = 'Shifted maps saved successfully')
-        os.chdir(TEMP_PATH)
         self.allChangesSaved = True
         return 0
     
@@ -191,23 +198,45 @@ class ShiftTab(Frame):
         # Get current average spectra
         window.getAverageSpectra()
         
-        # Reinitialize plot
-        plot = window.plotFrame.figure.reInitPlot()
+        # Start a new display, reusing the plotted lines
+        window.plotFrame.figure.startDisplay()
+        
+        # Plot all average spectra
+        window.plotAverages()
         
-        for col, spectra in window.averages.enumerate():  
-            # Plot all average spectra
-            plot.plot(spectra[1][0],spectra[1][1], 
-                      color = COLORS[col % len(COLORS)])
+        # Add the spectra statistics, if chosen by user
+        window.plotStatistics()
         
         # If an actual data point was selected, plot it with a big X
-        if self.actual[0].get() != '':
-            plot.plot(float(self.actual[0].get()), 
-                      float(self.actual[1].get()), 'kx', markersize = 20)
+        self.plotPoint(window)
 
         # Save new limits
+        window.plotFrame.figure.rescale()
         window.plotFrame.figure.saveLimits()
         window.plotFrame.figure.drawCanvas()
         
         # Update Status Frame
         self.window.statFrame.getLimits()
         return 0
+    
+    def plotPoint(self, window: Tk = None):
+        ''' Sets the selected actual data point, as an overlay of the plot '''
+        if window is None:
+            window = self.window
+        
+        points = []
+        if self.actual[0].get() != '':
+            points.append(([float(self.actual[0].get())], [float(self.actual[1].get())], 
+                           {'color': 'k', 'marker': 'x', 'linestyle': 'none', 'markersize': 20}))
+        
+        window.plotFrame.figure.setLines('shiftPoint', points, overlay = True)
+        return 0
+    
+    def displayPoint(self):
+        ''' Redraws only the selected data point '''
+        if self.window.maps.isEmpty():
+            return 1
+        
+        self.plotPoint()
+        self.window.plotFrame.figure.updateOverlay()
+        return 0
@@ -0,0 +1,76 @@
+import os
+import numpy as np
+from zipfile import ZipFile, ZIP_DEFLATED
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of threads writing files at once
+WRITE_WORKERS = 8
+
+class SpectraWriter:
+    ''' Writes individual spectra as text files with a frequency and an intensity column.
+    Each spectrum is formatted in a single operation from a template with the frequencies already written,
+    and the files are written from a pool of threads.
+    With archive, all files are stored in a single path.zip archive instead of the path folder.
+    To be used as a context manager, which waits for every file to be written '''
+    def __init__(self, path: str, frequencies: np.ndarray, header: str = 'Wavenumber(cm-1)\tIntensity',
+                 archive: bool = False, workers: int = WRITE_WORKERS):
+        self.path = path
+        self.archive = archive
+
+        # Every line has the frequency and a placeholder for the intensity
+        self.template = header.replace('%', '%%') + '\n' + ''.join(f'{freq:.2f}\t%.2f\n' for freq in frequencies)
+
+        if archive:
+            self.zipFile = ZipFile(f'{path}.zip', 'w', compression = ZIP_DEFLATED, compresslevel = 1)
+        else:
+            os.makedirs(path, exist_ok = True)
+            self.executor = ThreadPoolExecutor(max_workers = workers)
+            self.pending = []
+
+    def format(self, intensities: np.ndarray):
+        ''' Returns the file text for a spectrum '''
+        return self.template % tuple(intensities)
+
+    def write(self, names: list, spectra: np.ndarray):
+        ''' Writes a file for each spectrum in spectra, shape (n_spectra, n_freq), with the filenames in names '''
+        texts = [self.format(intensities) for intensities in spectra]
+
+        if self.archive:
+            for name, text in zip(names, texts):
+                self.zipFile.writestr(name, text)
+            return 0
+
+        # Only the files of the previous call can still be pending, which bounds the memory used
+        self.wait()
+        self.pending = [self.executor.submit(self.writeFile, os.path.join(self.path, name), text)
+                        for name, text in zip(names, texts)]
+        return 0
+
+    @staticmethod
+    def writeFile(filename: str, text: str):
+        with open(filename, 'w') as file:
+            file.write(text)
+        return 0
+
+    def wait(self):
+        ''' Waits for the pending files, raising any error found while writing them '''
+        for future in self.pending:
+            future.result()
+        self.pending = []
+        return 0
+
+    def close(self):
+        ''' Finishes writing every file '''
+        if self.archive:
+            self.zipFile.close()
+        else:
+            self.wait()
+            self.executor.shutdown()
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+        return False
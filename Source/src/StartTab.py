@@ -1,4 +1,3 @@
-from settings import COLORS
 from tkinter import Tk, Button
 from tkinter.ttk import Frame, Notebook
 
@@ -10,8 +9,8 @@ class StartTab(Frame):
         self.window = notebook.window # GUI class instance
         self.resetButton = Button(self, text = 'Restore program settings', 
                                   command = lambda: [self.window.resetGUI(), 
-                                                     self.window.legFrame.updateLegend()]
-                                  ).grid(column = 3, row = 0, sticky = 'w')
+                                                     self.window.legFrame.updateLegend()])
+        self.resetButton.grid(column = 3, row = 0, sticky = 'w')
     
     def clearTab(self):
         ''' Noting to clear '''
@@ -32,14 +31,16 @@ class StartTab(Frame):
         # Get current average spectra
         window.getAverageSpectra()
         
-        # Reinitialize plot
-        plot = window.plotFrame.figure.reInitPlot()
+        # Start a new display, reusing the plotted lines
+        window.plotFrame.figure.startDisplay()
         
-        for col, spectra in window.averages.enumerate():  
-            # Plot all average spectra
-            plot.plot(spectra[1][0],spectra[1][1], 
-                      color = COLORS[col % len(COLORS)])
+        # Plot all average spectra
+        window.plotAverages()
+        
+        # Add the spectra statistics, if chosen by user
+        window.plotStatistics()
 
+        window.plotFrame.figure.rescale()
         window.plotFrame.figure.saveLimits()
         window.plotFrame.figure.drawCanvas()
         
@@ -52,6 +52,11 @@ class StatFrame(Frame):
         self.window.plotFrame.figure.changeYZoom()
         return 0
     
+    def cancelJob(self):
+        ''' Cancels the process running in the background '''
+        self.window.jobs.cancel()
+        return 0
+    
     def configureLayout(self):
         ''' Configure widget layout for the Frame'''
         Separator(self, orient = 'horizontal').grid(column = 0, columnspan = 11,  
@@ -66,6 +71,9 @@ class StatFrame(Frame):
                               row = 2, rowspan = 2, 
                               padx = 5, pady = 5, sticky = 'we')
         
+        self.btnCancel = Button(self, text = 'Cancel', state = 'disabled', command = self.cancelJob)
+        self.btnCancel.grid(column = 4, row = 2, sticky = 'w')
+        
         Separator(self, orient = 'vertical').grid(column = 5, row = 1, rowspan = 3,
                                                   sticky = 'ns', pady = 5)
         # Setup progress bar
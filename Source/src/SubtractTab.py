@@ -1,13 +1,13 @@
 import os
 import numpy as np
-from .Maps import Map
 from .Anchors import Anchors
 from functools import partial
-import matplotlib.pyplot as plt
 from idlelib.tooltip import Hovertip
 from settings import TEMP_PATH, COLORS
 from tkinter.filedialog import askopenfilename
-from .Global_Functions import findClosest, averageBox
+from .JobRunner import Job
+from .Pipeline import ANCHOR_BOX, subtractSpectra, saveBaselineParameters, readBaselineParameters
+from .Global_Functions import anchorBoxes, interpolationWeights, calculateBaselines
 from tkinter.messagebox import showinfo, askyesno, showerror
 from tkinter import Tk, Button, BooleanVar, Frame, Checkbutton, ttk
 
@@ -26,6 +26,9 @@ class SubtractTab(ttk.Frame):
         self.showSub = BooleanVar(value = False)
         self.varChkSubFig = BooleanVar(value = False)
         self.varChkOffset = BooleanVar(value = False)
+        
+        # Stores the subtracted average spectra
+        self.subAverages = []
 
         self.configureLayout()
         self.allChangesSaved = True
@@ -34,6 +37,7 @@ class SubtractTab(ttk.Frame):
         ''' Reinitialize tab '''
         self.anchors.clear()
         self.anchorBut.clear()
+        self.subAverages = []
         self.displayAnchors()
         self.showSub.set(False)
         self.varChkSubFig.set(False)
@@ -120,54 +124,51 @@ class SubtractTab(ttk.Frame):
             return 1 
     
         # For potentially long processes, a progress bar in the Status Frame is used to avoid user panic
-        progressStep = 300 / (self.window.maps.length() * self.window.maps[0].spectraNum)
-        self.window.statFrame.progressLabel.config(text = 'Processing:   Saving subtracted maps')
-        
+        total = self.window.maps.length() * self.window.maps[0].spectraNum
+        
+        # Anchors used for every map, even if they are edited while the maps are subtracted
+        anchors = list(self.anchors.asList())
+        saveFigures = self.varChkSubFig.get()
+        
+        # The maps are subtracted in the background. The maps saved before a cancellation are kept
+        saved = []
+        self.window.jobs.run('Saving subtracted maps', 
+                             partial(self.subtractMaps, anchors, saveFigures, saved), 
+                             partial(self.finishSubtract, anchors, saveFigures, saved), 
+                             total, 
+                             partial(self.window.commitMaps, saved))
+        return 0
+    
+    def subtractMaps(self, anchors: list, saveFigures: bool, saved: list, job: Job):
+        ''' Saves the subtracted maps and their individual spectra, adding a (Map, name) tuple to saved for each map. 
+        Runs in the background, so it does not use any widget or change the Map elements '''
         for map in self.window.maps:
-            os.chdir(map.directory)
-            
             # Load map data
             mapData = self.window.readMap(map)
             
-            # Add a suffix no the Map name, but only once
-            if '_subtracted' not in map.name: 
-                map.name = map.name + '_subtracted'
+            subData = self.window.createMap(map, mapData.freq, mapData.coords)
             
-            frequencies = mapData.pop('freq')
+            # Subtract the baselines and save the individual spectra ( and figures, if chosen by user)
+            subtractSpectra(mapData, subData, anchors, map, saveFigures, job.progress)
             
-            for key, intensities in mapData.items():
-                
-                # Get the intensity values for each frequency anchor point in Anchors object
-                yAnchors = [averageBox(intensities, findClosest(anchor, frequencies), 3) for anchor in self.anchors]   
-            
-                # Interpolate between anchor points in the range of frequencies
-                yBase = np.interp(frequencies, 
-                                  self.anchors.asList(),
-                                  yAnchors)
-
-                # Subtract the intensity data to interpolated data                  
-                mapData[key] = np.array(mapData[key]) - yBase
-                
-                # Save individual spectra ( and figures, if chosen by user)
-                self.saveSubSpectra(key, mapData[key], frequencies, map)
-                if self.varChkSubFig.get():
-                    self.saveSubFigures(key, map, frequencies, intensities, yAnchors, yBase)
-                
-                # Update progress bar
-                self.window.statFrame.progressBar['value'] += progressStep
-                self.window.statFrame.update_idletasks()
+            # Add a suffix no the Map name, but only once
+            name = map.name if '_subtracted' in map.name else map.name + '_subtracted'
             
-            # Add back the frequencies to the map and write the new map to temp and directory
-            mapData['freq'] = frequencies
-            self.window.writeMap(map, mapData)
+            # Write the new map to temp and directory
+            self.window.writeMap(map, subData, name)
+            saved.append((map, name))
 
             # Save the baseline parameters used
-            self.saveBaselineParameters(map)
-            
-        # Reset progress bar
-        self.window.statFrame.progressBar['value'] = 0
-        self.window.statFrame.progressLabel.config(text = 'Processing: ')
-        self.window.statFrame.update_idletasks()
+            saveBaselineParameters(map, anchors)
+        return 0
+    
+    def finishSubtract(self, anchors: list, saveFigures: bool, saved: list, result: int):
+        ''' Updates the Tab once the subtracted maps are saved '''
+        # Use the subtracted maps as the current ones
+        self.window.commitMaps(saved)
+        
+        # Record the step to replay it on other maps
+        self.window.recipe.add('subtract', anchors = anchors, figures = saveFigures)
         
         # Update legend to reflect new map names
         self.window.legFrame.updateLegend()
@@ -187,98 +188,6 @@ class SubtractTab(ttk.Frame):
         self.allChangesSaved = True    
         return 0
 
-    def saveSubSpectra(self, key: tuple, intensities: list, frequencies: list, map: Map):
-        ''' Saves the individual subtracted spectra and redirects the figure creation if chosen.'''
-        os.chdir(map.directory)
-
-        os.makedirs(f'{map.orig}_Files/Individual Spectra/Subtracted', exist_ok = True)
-        
-        os.chdir(f'{map.orig}_Files/Individual Spectra/Subtracted')
-        
-        # Remove decimal to avoid filename corruption
-        x = key[0].replace('.', '')
-        y = key[1].replace('.', '')
-
-        # Save the number of decimals for the filename
-        if '.' in key[0]:
-            xDec = len(key[0]) - key[0].index('.') - 1
-        else:
-            xDec = 0
-        
-        if '.' in key[1]:
-            yDec = len(key[1]) - key[1].index('.') - 1
-        else:
-            yDec = 0
-        
-        # Write file
-        with open(f'{map.orig}_X_{x}_E-{xDec}_Y_{y}_E-{yDec}_subtracted.txt', 'w') as newFile:
-            newFile.write('Wavenumber(cm-1)\tIntensity\n')
-
-            for freq, inten in zip(frequencies, intensities):
-                newFile.write(f'{freq:.2f}\t{inten:.2f}\n')
-        return 0
-
-    def saveSubFigures(self, key: tuple, map: Map, frequencies: list, intensities: list, yAnchors: np.ndarray, yBase: np.ndarray): 
-
-        os.chdir(map.directory)
-
-        os.makedirs(f'{map.orig}_Files/Figures/Subtracted', exist_ok = True)
-        
-        os.chdir(f'{map.orig}_Files/Figures/Subtracted')
-        
-        fig = plt.Figure()
-        plot1 = fig.add_subplot(111, xlabel = 'Wavenumber (cm-1)', ylabel = 'Intensity')
-        
-        # Plot data, the baseline as a line and the anchor points
-        plot1.plot(frequencies, intensities, 'k')
-        plot1.plot(self.anchors.asList(), yAnchors, c = 'grey')
-        plot1.plot(self.anchors.asList(), yAnchors, ' o', c = 'grey')
-        
-        # Remove decimal to avoid filename corruption
-        x = key[0].replace('.', '')
-        y = key[1].replace('.', '')
-
-        # Save the number of decimals for the filename
-        if '.' in key[0]:
-            xDec = len(key[0]) - key[0].index('.') - 1
-        else:
-            xDec = 0
-        
-        if '.' in key[1]:
-            yDec = len(key[1]) - key[1].index('.') - 1
-        else:
-            yDec = 0
-
-        fig.savefig(f'{map.orig}_X_{x}_E-{xDec}_Y_{y}_E-{yDec}_baseline.png')
-        plt.close()
-        
-        fig = plt.Figure()
-        plot1 = fig.add_subplot(111, xlabel = 'Wavenumber (cm-1)', ylabel = 'Intensity')
-        
-        # Plot the subtracted data
-        plot1.plot(frequencies, intensities - yBase, 'k')
-
-        fig.savefig(f'{map.orig}_X_{x}_E-{xDec}_Y_{y}_E-{yDec}_subtracted.png')
-        plt.close()
-        
-        os.chdir(map.directory)
-        return 0
-
-    def saveBaselineParameters(self, map: Map):
-        ''' Save the baseline parameters used for future reference '''
-        os.chdir(map.directory)
-
-        os.makedirs(f'{map.orig}_Files/Parameters', exist_ok = True)
-        
-        with open(f'{map.orig}_Files/Parameters/BaselineParameters.txt', 'w') as newFile:
-            newFile.write('Linear interpolation between anchor points.\n')
-            newFile.write('Intensity value for each anchor is an average intensity of box = 3.\n\n')
-            newFile.write('Anchor points (cm-1):')
-            
-            for anchor in self.anchors:
-                newFile.write(f' {anchor:.2f}')
-        return 0
-    
     def importBaseline(self):
         ''' Import a previously used baseline from a file output of saveBaselineParameters method'''
         if not self.anchors.isEmpty():
@@ -294,25 +203,17 @@ class SubtractTab(ttk.Frame):
                                    initialdir = '/', 
                                    filetypes = (('Text files', '*.txt'),))
     
-        with open(filename, 'r') as file:
-            lines = file.readlines()
-        
-        # Check for correct content - can fail for an unfortunate selection
-        if 'Linear interpolation' not in lines[0]:
+        try:
+            anchors = readBaselineParameters(filename)
+        except ValueError as error:
             showerror('Wrong file type',
                       'Selected file is not the right ' + 
-                      'format for baseline import\n' +
-                      'File must be the result of a baseline subtraction')
+                      'format for baseline import\n' + str(error))
             return 1
         
-        # Use only anchors line
-        lines = lines[2:]
-        
-        for line in lines:
-            lineSplit = line.split()[3:]
-            for anchor in lineSplit:
-                # Add an anchor for each number in the list
-                self.anchor.addAnchor(float(anchor))
+        for anchor in anchors:
+            # Add an anchor for each number in the list
+            self.anchors.addAnchor(anchor)
         
         # Display new anchors and spectra
         self.displayAnchors()
@@ -329,14 +230,16 @@ class SubtractTab(ttk.Frame):
         # Get the current average spectra
         self.window.getAverageSpectra()
         
+        # The subtracted averages are kept apart to leave the cached averages untouched
+        self.subAverages = []
+        
         for map, spectra in self.window.averages:
-            # Get the intensity value for each anchor value
-            yAnchors = [averageBox(spectra[1],findClosest(anchor, spectra[0]), 3) for anchor in self.anchors]
-
-            # Create interpolation between anchors
-            yBase = np.interp(spectra[0], self.anchors.asList(), yAnchors)
+            # Get the intensity value for each anchor value and create interpolation between anchors
+            yAnchors, yBase = calculateBaselines(np.atleast_2d(spectra[1]),
+                                                 anchorBoxes(spectra[3], self.anchors.asList(), ANCHOR_BOX),
+                                                 interpolationWeights(spectra[0], self.anchors.asList()))
             
-            spectra[1] -= yBase
+            self.subAverages.append([map, [spectra[0], spectra[1] - yBase[0]]])
         
         # To differentiate between a function call from Show Subtracted button 
         # and a call from showSubtractedAvg method
@@ -351,11 +254,11 @@ class SubtractTab(ttk.Frame):
         if self.window.maps.isEmpty():
             return 1
     
-        # Generate the subtracted averages in window.averages but don't show them
+        # Generate the subtracted averages in subAverages but don't show them
         # This way, the maps are not saved but the averages are subtracted
         self.showSubtracted(False)
         
-        for map, spectra in self.window.averages:
+        for map, spectra in self.subAverages:
             os.chdir(map.directory)
             
             os.makedirs(f'{map.orig}_Files/Average Spectra', exist_ok = True) 
@@ -386,43 +289,45 @@ class SubtractTab(ttk.Frame):
         if window.maps.isEmpty():
             return 1
         
-        # Used when called from showSubtracted method to bypass
-        # the clearing and writing os window.averages containing the subtracted spectra
-        if not self.showSub.get():
-            window.getAverageSpectra()
+        # Used when called from showSubtracted method to plot
+        # the subtracted spectra instead of window.averages
+        window.getAverageSpectra()
+        averages = self.subAverages if self.showSub.get() else window.averages.averages
         
-        # Reinitialize PltFigure object
-        plot = window.plotFrame.figure.reInitPlot()
+        # Start a new display, reusing the plotted lines
+        figure = window.plotFrame.figure
+        figure.startDisplay()
         
         # Add the frequency extreme anchors, relevant only when accessing tab
         # as addAnchors method doesn't allow duplicates
         self.anchors.addAnchor(window.averages.averages[0][1][0][ 0])
         self.anchors.addAnchor(window.averages.averages[0][1][0][-1])
         
-        for col, spectra in window.averages.enumerate():  
+        lines = []
+        for col, spectra in enumerate(averages):  
+            offset = 0
             if self.showSub.get() and self.varChkOffset.get():
                 # Add an offset between spectra for clarity - hardcoded to 30% of y axis range
                 # Maybe add an offset selector?
-                limits = self.window.plotFrame.figure.getLimits()[1].getYLim()
+                limits = figure.getLimits()[1].getYLim()
 
                 offset = (limits[1] - limits[0]) * 0.3 * (1 + col)
-
-                plot.plot(spectra[1][0], spectra[1][1] + offset, 
-                          color = COLORS[col % len(COLORS)])
-            else:
-                plot.plot(spectra[1][0], spectra[1][1], 
-                          color = COLORS[col % len(COLORS)])
-           
-            if not self.showSub.get():
-                # If it is not a showSubtracted method call, plot the anchor points and baseline 
-                yAnchors = [averageBox(spectra[1][1], findClosest(anchor, spectra[1][0]), 3) for anchor in self.anchors]
-    
-                plot.plot(self.anchors.asList(), yAnchors, '#808080')
-                plot.plot(self.anchors.asList(), yAnchors, ' o', c = 'grey')
+            
+            lines.append((spectra[1][0], spectra[1][1] + offset, {'color': COLORS[col % len(COLORS)]}))
+        
+        figure.setLines('averages', lines)
+        
+        # Add the spectra statistics, if chosen by user, except for the subtracted averages
+        if not self.showSub.get():
+            window.plotStatistics()
+        
+        # If it is not a showSubtracted method call, plot the anchor points and baseline
+        self.plotBaselines(window)
 
         # Save new limits
-        window.plotFrame.figure.saveLimits()
-        window.plotFrame.figure.drawCanvas()
+        figure.rescale()
+        figure.saveLimits()
+        figure.drawCanvas()
         
         # Display new limits in Status Frame
         self.window.statFrame.getLimits()
@@ -431,11 +336,45 @@ class SubtractTab(ttk.Frame):
         self.displayAnchors()
         return 0
     
+    def plotBaselines(self, window: Tk = None):
+        ''' Sets the anchor points and baseline of each average spectra, as an overlay of the plot.
+        Nothing is shown with the subtracted averages '''
+        if window is None:
+            window = self.window
+        
+        lines = []
+        if not self.showSub.get():
+            anchors = self.anchors.asList()
+            
+            for spectra in window.averages:
+                yAnchors, yBase = calculateBaselines(np.atleast_2d(spectra[1][1]),
+                                                     anchorBoxes(spectra[1][3], anchors, ANCHOR_BOX),
+                                                     interpolationWeights(spectra[1][0], anchors))
+                
+                lines.append((anchors, yAnchors[0], {'color': '#808080'}))
+                lines.append((anchors, yAnchors[0], {'color': 'grey', 'marker': 'o', 'linestyle': 'none'}))
+        
+        window.plotFrame.figure.setLines('baselines', lines, overlay = True)
+        return 0
+    
+    def displayBaselines(self):
+        ''' Redraws only the anchor points and baselines '''
+        if self.window.maps.isEmpty():
+            return 1
+        
+        self.plotBaselines()
+        self.window.plotFrame.figure.updateOverlay()
+        return 0
+    
     def delAnchor(self, anchor: float):
         ''' Delete a selected anchor from Anchors object. Called from the anchor buttons'''
-        self.anchors.delAnchor(anchor)
+        if self.anchors.delAnchor(anchor):
+            showerror('Error', 
+                      'Cannot remove the spectra limits')
+            return 1
+        
         self.displayAnchors()
-        self.displaySpectra()
+        self.displayBaselines()
         return 0
     
     def displayAnchors(self):
@@ -464,8 +403,8 @@ class SubtractTab(ttk.Frame):
         if self.anchors.addAnchor(x):
             return 1
         
-        # Display anchors and spectra
+        # Display anchors and baselines
         self.displayAnchors()
-        self.displaySpectra()   
+        self.displayBaselines()
         self.allChangesSaved = False
         return 0 